@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, field
+from typing import Dict, List, Optional, Iterator, Sequence
+
+from characterProperties import Attributes, Skills, Tier
+from xpOptimizerResults import format_markdown_table
+
+SERVER_MODES = ('dev', 'gunicorn')
+SERVICE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+SERVER_STARTUP_TIMEOUT = 30.0
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+@dataclass
+class RequestSample:
+    # Latency is measured from the scheduled arrival (open loop) or the send time (closed loop).
+    latency: float
+    status: Optional[int] = None
+    is_timeout: bool = False
+
+    @property
+    def is_error(self) -> bool:
+        return not self.is_timeout and (self.status is None or self.status >= 400)
+
+
+@dataclass
+class LoadTestReport:
+    server_mode: str
+    request_count: int
+    duration: float
+    throughput: float
+    latency_percentiles: Dict[int, float]
+    max_latency: float
+    error_rate: float
+    timeout_rate: float
+    status_counts: Dict[str, int] = field(default_factory=dict)
+
+    @classmethod
+    def from_samples(cls,
+                     server_mode: str,
+                     samples: Sequence[RequestSample],
+                     duration: float,
+                     timeout: float = 0.0) -> LoadTestReport:
+        """
+        :param timeout: The timeout [s] per request. Timed out requests count with at least this latency.
+        :return: The report; the latencies include failed & timed out requests, so overload is not hidden by them.
+        """
+        latencies = sorted(max(sample.latency, timeout) if sample.is_timeout else sample.latency for sample in samples)
+        request_count = len(samples)
+        return cls(server_mode=server_mode,
+                   request_count=request_count,
+                   duration=duration,
+                   throughput=request_count / duration if duration > 0 else 0.0,
+                   latency_percentiles={percent: get_percentile(latencies, percent)
+                                        for percent in LATENCY_PERCENTILES},
+                   max_latency=latencies[-1] if latencies else 0.0,
+                   error_rate=sum(sample.is_error for sample in samples) / request_count if request_count else 0.0,
+                   timeout_rate=sum(sample.is_timeout for sample in samples) / request_count if request_count else 0.0,
+                   status_counts=dict(Counter('timeout' if sample.is_timeout else str(sample.status)
+                                              for sample in samples)))
+
+
+def get_percentile(sorted_values: Sequence[float], percent: float) -> float:
+    """
+    :return: The nearest-rank percentile of the sorted values (0 for no values).
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def generate_corpus(size: int, seed: int = 0) -> List[Dict[str, int]]:
+    """
+    Creates random, valid target values with a few attribute & skill targets each.
+    """
+    generator = random.Random(seed)
+    attributes = list(Attributes.get_valid_members())
+    skills = list(Skills.get_valid_members())
+    corpus = []
+    for _ in range(size):
+        target_values = {Tier.full_name: generator.randint(Tier.rating_bounds.min, Tier.rating_bounds.max)}
+        for attribute in generator.sample(attributes, generator.randint(0, 2)):
+            target_values[attribute.name] = generator.randint(2, 6)
+        for skill in generator.sample(skills, generator.randint(1, 4)):
+            target_values[skill.name] = generator.randint(3, 10)
+        corpus.append(target_values)
+    return corpus
+
+
+def load_corpus(file_name: str) -> List[Dict[str, int]]:
+    """
+    :param file_name: A json file with a single target values object or a list of them, or a json lines file.
+    """
+    with open(file_name, 'r') as file:
+        content = file.read()
+    try:
+        corpus = json.loads(content)
+    except json.JSONDecodeError:
+        corpus = [json.loads(line) for line in content.splitlines() if line.strip()]
+    return corpus if isinstance(corpus, list) else [corpus]
+
+
+def send_request(base_url: str, target_values: Dict[str, int], client_id: str, timeout: float) -> RequestSample:
+    url = f"{base_url}/optimize_xp?" + urllib.parse.urlencode({'target_values': json.dumps(target_values)})
+    http_request = urllib.request.Request(url, headers={'X-API-Key': client_id})
+    start_time = time.perf_counter()
+    try:
+        with urllib.request.urlopen(http_request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as error:
+        status = error.code
+    except (socket.timeout, TimeoutError):
+        return RequestSample(latency=time.perf_counter() - start_time, is_timeout=True)
+    except urllib.error.URLError as error:
+        is_timeout = isinstance(error.reason, (socket.timeout, TimeoutError))
+        return RequestSample(latency=time.perf_counter() - start_time, is_timeout=is_timeout)
+    return RequestSample(latency=time.perf_counter() - start_time, status=status)
+
+
+def run_load(base_url: str,
+             corpus: Sequence[Dict[str, int]],
+             request_count: int,
+             concurrency: int = 4,
+             arrival_rate: float = 0.0,
+             client_count: int = 0,
+             timeout: float = 60.0,
+             seed: int = 0) -> List[RequestSample]:
+    """
+    Replays the corpus (cyclically) against the service.
+    :param arrival_rate: Mean requests per second with exponential inter-arrival times (open loop). Requests wait for
+    a free connection, the waiting time counts as latency. Non-positive values send as fast as possible (closed loop).
+    :param client_count: Number of distinct client ids (X-API-Key), defaults to the concurrency.
+    :return: One sample per request, in order of completion.
+    """
+    generator = random.Random(seed)
+    client_count = client_count if client_count > 0 else concurrency
+    samples: List[RequestSample] = []
+    samples_lock = threading.Lock()
+
+    def run_request(index: int, scheduled_time: Optional[float]):
+        sample = send_request(base_url, corpus[index % len(corpus)], f"load-test-{index % client_count}", timeout)
+        if scheduled_time is not None:
+            sample.latency = time.perf_counter() - scheduled_time
+        with samples_lock:
+            samples.append(sample)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        scheduled_time = time.perf_counter()
+        for index in range(request_count):
+            if arrival_rate > 0:
+                scheduled_time += generator.expovariate(arrival_rate)
+                time.sleep(max(0.0, scheduled_time - time.perf_counter()))
+                executor.submit(run_request, index, scheduled_time)
+            else:
+                executor.submit(run_request, index, None)
+    return samples
+
+
+def get_server_command(server_mode: str, host: str, port: int, worker_count: int) -> List[str]:
+    if server_mode == 'dev':
+        return [sys.executable, '-m', 'flask', 'run', '--host', host, '--port', str(port), '--with-threads']
+    if server_mode == 'gunicorn':
+        if importlib.util.find_spec('gunicorn') is None:
+            raise IOError("Server mode 'gunicorn' requires gunicorn ('pip install gunicorn').")
+        # Threaded workers, so the admission queue of each worker sees concurrent requests.
+        return [sys.executable, '-m', 'gunicorn', '--workers', str(worker_count), '--threads', '4',
+                '--bind', f"{host}:{port}", '--timeout', '0', 'xpOptimizerService:app']
+    raise IOError(f"Unknown server mode '{server_mode}', expected one of {SERVER_MODES}.")
+
+
+@contextmanager
+def local_server(server_mode: str, host: str, port: int, worker_count: int) -> Iterator[str]:
+    """
+    Starts the service in a subprocess & waits until it answers.
+    :return: The base URL of the service.
+    """
+    base_url = f"http://{host}:{port}"
+    environment = dict(os.environ, FLASK_APP='xpOptimizerService.py')
+    process = subprocess.Popen(get_server_command(server_mode, host, port, worker_count),
+                               cwd=SERVICE_DIRECTORY,
+                               env=environment,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + SERVER_STARTUP_TIMEOUT
+        while True:
+            if process.poll() is not None:
+                raise IOError(f"Server mode '{server_mode}' exited with code {process.returncode} during startup.")
+            try:
+                with urllib.request.urlopen(f"{base_url}/metrics", timeout=1):
+                    break
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                if time.monotonic() > deadline:
+                    raise IOError(f"Server mode '{server_mode}' did not answer within {SERVER_STARTUP_TIMEOUT}s.")
+                time.sleep(0.1)
+        yield base_url
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def format_reports(reports: Sequence[LoadTestReport]) -> str:
+    column_names = ['Requests', 'Throughput [1/s]'] \
+        + [f"p{percent} [ms]" for percent in LATENCY_PERCENTILES] \
+        + ['Max [ms]', 'Errors [%]', 'Timeouts [%]']
+    rows = [(report.server_mode,
+             [report.request_count, f"{report.throughput:.2f}"]
+             + [f"{report.latency_percentiles[percent] * 1000:.0f}" for percent in LATENCY_PERCENTILES]
+             + [f"{report.max_latency * 1000:.0f}", f"{report.error_rate * 100:.1f}",
+                f"{report.timeout_rate * 100:.1f}"])
+            for report in reports]
+    return format_markdown_table(column_names, rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Load test for the XP optimizer service. Starts the service locally in each server mode (or uses "
+                    "the given URL), replays the target values & reports throughput, latency percentiles and "
+                    "error/timeout rates per server mode.",
+        add_help=True)
+    parser.add_argument('-f', '--corpus_file',
+                        type=str,
+                        help='A json (lines) file with target values (single object or list). If not specified, a '
+                             'random corpus is generated.')
+    parser.add_argument('--corpus_size', type=int, default=50, help='Size of the generated corpus.')
+    parser.add_argument('-n', '--requests', type=int, default=100, help='Number of requests per server mode.')
+    parser.add_argument('-c', '--concurrency', type=int, default=4, help='Max. number of requests in flight.')
+    parser.add_argument('-r', '--arrival_rate',
+                        type=float,
+                        default=0.0,
+                        help='Mean arrivals per second (Poisson). If not positive, requests are sent as fast as '
+                             'the concurrency allows.')
+    parser.add_argument('--clients', type=int, default=0, help='Number of distinct client ids (default: concurrency).')
+    parser.add_argument('-t', '--timeout', type=float, default=60.0, help='Timeout [s] per request.')
+    parser.add_argument('-m', '--server_modes',
+                        nargs='+',
+                        choices=SERVER_MODES,
+                        default=list(SERVER_MODES),
+                        help='Server modes to compare.')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help='Workers of the WSGI server.')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5077)
+    parser.add_argument('-u', '--url', type=str, help='Base URL of an already running service (no server is started).')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-j', '--return_json',
+                        action='store_true',
+                        help='If enabled, prints the reports as JSON string instead of as Markdown table (default).')
+    input_arguments = vars(parser.parse_args())
+
+    input_corpus = load_corpus(input_arguments['corpus_file']) if input_arguments['corpus_file'] is not None \
+        else generate_corpus(input_arguments['corpus_size'], seed=input_arguments['seed'])
+
+    def run_report(server_mode: str, base_url: str) -> LoadTestReport:
+        start_time = time.perf_counter()
+        load_samples = run_load(base_url, input_corpus,
+                                request_count=input_arguments['requests'],
+                                concurrency=input_arguments['concurrency'],
+                                arrival_rate=input_arguments['arrival_rate'],
+                                client_count=input_arguments['clients'],
+                                timeout=input_arguments['timeout'],
+                                seed=input_arguments['seed'])
+        return LoadTestReport.from_samples(server_mode, load_samples, time.perf_counter() - start_time,
+                                           timeout=input_arguments['timeout'])
+
+    load_test_reports = []
+    if input_arguments['url'] is not None:
+        load_test_reports.append(run_report(input_arguments['url'], input_arguments['url'].rstrip('/')))
+    else:
+        for input_server_mode in input_arguments['server_modes']:
+            try:
+                with local_server(input_server_mode, input_arguments['host'], input_arguments['port'],
+                                  input_arguments['workers']) as server_url:
+                    load_test_reports.append(run_report(input_server_mode, server_url))
+            except IOError as server_error:
+                print(f"Skipping server mode '{input_server_mode}': {server_error}", file=sys.stderr)
+
+    if input_arguments['return_json']:
+        print(json.dumps([asdict(report) for report in load_test_reports], indent=2))
+    else:
+        print(format_reports(load_test_reports))
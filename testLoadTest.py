@@ -0,0 +1,76 @@
+import threading
+import unittest
+
+from werkzeug.serving import make_server
+
+import xpOptimizer
+from loadTest import RequestSample, LoadTestReport, get_percentile, generate_corpus, run_load
+from xpOptimizerService import app
+
+
+class TestGetPercentile(unittest.TestCase):
+    def test_percentiles_expect_nearest_rank(self):
+        values = list(range(1, 11))
+        self.assertEqual(5, get_percentile(values, 50))
+        self.assertEqual(9, get_percentile(values, 90))
+        self.assertEqual(10, get_percentile(values, 99))
+        self.assertEqual(1, get_percentile(values, 0))
+
+    def test_no_values_expect_zero(self):
+        self.assertEqual(0.0, get_percentile([], 50))
+
+
+class TestLoadTestReport(unittest.TestCase):
+    def test_from_samples_expect_rates_and_status_counts(self):
+        samples = [RequestSample(latency=0.1, status=200),
+                   RequestSample(latency=0.3, status=200),
+                   RequestSample(latency=0.2, status=429),
+                   RequestSample(latency=5.0, is_timeout=True)]
+        report = LoadTestReport.from_samples('dev', samples, duration=2.0)
+        self.assertEqual(2.0, report.throughput)
+        self.assertEqual(0.25, report.error_rate)
+        self.assertEqual(0.25, report.timeout_rate)
+        self.assertEqual(0.2, report.latency_percentiles[50])
+        self.assertEqual(5.0, report.max_latency)
+        self.assertEqual({'200': 2, '429': 1, 'timeout': 1}, report.status_counts)
+
+    def test_failed_and_timed_out_requests_expect_counted_in_latency_percentiles(self):
+        samples = [RequestSample(latency=0.1, status=200)] * 8 \
+            + [RequestSample(latency=0.01), RequestSample(latency=5.0, is_timeout=True)]
+        report = LoadTestReport.from_samples('dev', samples, duration=1.0, timeout=10.0)
+        self.assertEqual(0.1, report.latency_percentiles[50])
+        self.assertEqual(10.0, report.latency_percentiles[99])
+        self.assertEqual(10.0, report.max_latency)
+        self.assertEqual(0.1, report.error_rate)
+
+
+class TestGenerateCorpus(unittest.TestCase):
+    def test_generated_corpus_expect_valid_and_reproducible_target_values(self):
+        corpus = generate_corpus(20, seed=1)
+        self.assertEqual(20, len(corpus))
+        self.assertTrue(all(xpOptimizer.is_valid_target_values_dict(target_values) for target_values in corpus))
+        self.assertEqual(corpus, generate_corpus(20, seed=1))
+
+
+class TestRunLoad(unittest.TestCase):
+    def setUp(self):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server_thread.join()
+
+    def test_closed_form_corpus_expect_all_requests_succeed(self):
+        corpus = [{"Tier": 1, "Stealth": 4}, {"Tier": 2, "Agility": 3, "Tech": 5}]
+        for arrival_rate in [0.0, 50.0]:
+            with self.subTest(arrival_rate=arrival_rate):
+                samples = run_load(self.base_url, corpus, request_count=6, concurrency=2, arrival_rate=arrival_rate)
+                self.assertEqual(6, len(samples))
+                self.assertTrue(all(sample.status == 200 for sample in samples))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,20 @@
+import csv
+import io
 import json
+import os
+import tempfile
+import threading
 import unittest
 from dataclasses import dataclass
 from typing import Dict
+from unittest.mock import patch
 
 from characterProperties import Tier, IntBounds, Attributes, Skills, Traits
-from xpOptimizer import AttributeSkillOptimizer, is_valid_target_values_dict
-from xpOptimizerResults import CharacterPropertyResults, XPCost, AttributeSkillOptimizerResults
+from xpOptimizer import AttributeSkillOptimizer, is_valid_target_values_dict, GekkoContext, SolveResourceUsage, \
+    get_canonical_names, SolverTelemetry, TARGET_VECTOR_NAMES, get_target_values_from_vector, \
+    get_current_ratings_from_vector, export_optimized_xp, optimize_xp, MinlpSolveError
+from xpOptimizerResults import CharacterPropertyResults, XPCost, AttributeSkillOptimizerResults, SkillResults, \
+    CompactResults, CsvResultWriter, JsonLinesResultWriter, MarkdownResultWriter
 
 
 @dataclass
@@ -44,6 +53,193 @@ class TestXPCost(unittest.TestCase):
             XPCost(attribute_costs, skill_costs, total_costs + 1)
 
 
+class TestCompactResults(unittest.TestCase):
+    # noinspection PyPep8Naming
+    EXPECTED_RESULTS_FILE_NAME = "TestChar_ExpectedResults"
+
+    def setUp(self):
+        with open(f"{self.EXPECTED_RESULTS_FILE_NAME}.json", "r") as expected_results_file:
+            self.expected_json = expected_results_file.read()
+        as_dict = json.loads(self.expected_json)
+        self.result = AttributeSkillOptimizerResults(
+            tier=as_dict['Tier'],
+            attributes=CharacterPropertyResults(as_dict['Attributes']['Total'], as_dict['Attributes']['Target']),
+            skills=SkillResults(as_dict['Skills']['Rating'], as_dict['Skills']['Total'], as_dict['Skills']['Target']),
+            traits=CharacterPropertyResults(as_dict['Traits']['Total'], as_dict['Traits']['Target']),
+            xp_cost=XPCost(as_dict['XPCost']['Attributes'], as_dict['XPCost']['Skills']))
+
+    def test_to_markdown_expect_match_to_stored_table(self):
+        with open(f"{self.EXPECTED_RESULTS_FILE_NAME}.md", "r") as expected_results_file:
+            self.assertEqual(expected_results_file.read(), CompactResults.from_results(self.result).to_markdown())
+
+    def test_to_json_expect_match_to_stored_json_and_dict_of_result(self):
+        compact_result = CompactResults.from_results(self.result)
+        self.assertEqual(self.expected_json, compact_result.to_json(indent=2))
+        self.assertEqual(dict(self.result), json.loads(compact_result.to_json()))
+        self.assertNotIn(' ', compact_result.to_json())
+
+    def test_to_vector_expect_positional_layout_of_result(self):
+        vector = CompactResults.from_results(self.result).to_vector()
+        self.assertEqual(1 + 7 + 2 * 18 + 8 + 2, len(vector))
+        self.assertEqual(self.result.Tier, vector[0])
+        self.assertEqual(list(self.result.Attributes.Total.values()), vector[1:8])
+        self.assertEqual(list(self.result.Skills.Rating.values()), vector[8:26])
+        self.assertEqual(list(self.result.Skills.Total.values()), vector[26:44])
+        self.assertEqual(list(self.result.Traits.Total.values()), vector[44:52])
+        self.assertEqual([self.result.XPCost.Attributes, self.result.XPCost.Skills], vector[52:])
+
+    def test_missed_target_expect_marked_in_all_formats(self):
+        self.result.Attributes.Target['Strength'] = self.result.Attributes.Total['Strength'] + 1
+        compact_result = CompactResults.from_results(self.result)
+        self.assertEqual(['Strength'], compact_result.to_dict()['Attributes']['Missed'])
+        self.assertIn('Strength   | 1      | 2      | YES', compact_result.to_markdown())
+        self.assertIn((3, 'Attributes', 'Strength', None, 1, 2, 'YES'), list(compact_result.iter_csv_rows()))
+
+    def test_result_writers_expect_one_entry_per_written_result(self):
+        result_count = 3
+        for writer_class in [CsvResultWriter, JsonLinesResultWriter, MarkdownResultWriter]:
+            with self.subTest(i=writer_class.__name__):
+                stream = io.StringIO()
+                writer_class(stream).write_all([self.result] * result_count)
+                if writer_class is CsvResultWriter:
+                    rows = list(csv.reader(io.StringIO(stream.getvalue())))
+                    self.assertEqual(list(CsvResultWriter.HEADER), rows[0])
+                    self.assertEqual({str(i) for i in range(result_count)}, {row[0] for row in rows[1:]})
+                elif writer_class is JsonLinesResultWriter:
+                    lines = stream.getvalue().splitlines()
+                    self.assertEqual([dict(self.result)] * result_count, [json.loads(line) for line in lines])
+                else:
+                    self.assertEqual(result_count, stream.getvalue().count('## XPCost'))
+
+    def test_export_optimized_xp_expect_one_json_line_per_target_values(self):
+        target_values_list = [{"Tier": 1, "Stealth": 5}, {"Tier": 2, "Agility": 3}]
+        stream = io.StringIO()
+        self.assertEqual(2, export_optimized_xp(target_values_list, stream, output_format='json'))
+        self.assertEqual([dict(optimize_xp(dict(target_values))) for target_values in target_values_list],
+                         [json.loads(line) for line in stream.getvalue().splitlines()])
+        with self.assertRaises(IOError):
+            export_optimized_xp(target_values_list, stream, output_format='xml')
+
+
+class TestGekkoContext(unittest.TestCase):
+    def test_exception_within_context_expect_temp_directory_removed_and_usage_recorded(self):
+        context = GekkoContext(remote=False)
+        previous_solve_count = GekkoContext.cumulative_usage.solve_count
+        with self.assertRaises(RuntimeError):
+            with context as solver:
+                self.assertTrue(os.path.isdir(solver._path))
+                raise RuntimeError()
+        self.assertFalse(os.path.isdir(context.solver._path))
+        self.assertEqual(1, context.usage.solve_count)
+        self.assertGreaterEqual(context.usage.wall_time, 0)
+        self.assertEqual(previous_solve_count + 1, GekkoContext.cumulative_usage.solve_count)
+
+    def test_concurrent_contexts_expect_all_usages_summed_up(self):
+        def enter_and_exit_contexts():
+            for _ in range(5):
+                with GekkoContext(remote=False):
+                    pass
+
+        previous_solve_count = GekkoContext.cumulative_usage.solve_count
+        threads = [threading.Thread(target=enter_and_exit_contexts) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(previous_solve_count + 20, GekkoContext.cumulative_usage.solve_count)
+
+    def test_optimize_selection_expect_resource_usage_of_solve(self):
+        optimizer = AttributeSkillOptimizer(tier=1)
+        optimizer.optimize_selection(target_values={"BallisticSkill": 4, "Stealth": 5})
+        self.assertEqual(1, optimizer.last_resource_usage.solve_count)
+        self.assertGreater(optimizer.last_resource_usage.temp_file_bytes, 0)
+
+    def test_exceeds_expect_only_counters_above_positive_thresholds(self):
+        usage = SolveResourceUsage(solve_count=10, wall_time=2.0, temp_file_bytes=100)
+        thresholds = SolveResourceUsage(solve_count=5, wall_time=0, temp_file_bytes=200)
+        self.assertEqual(['solve_count'], usage.exceeds(thresholds))
+
+
+class TestSolverTelemetry(unittest.TestCase):
+    APOPT_OUTPUT = """ ----------------------------------------------
+ Steady State Optimization with APOPT Solver
+ ----------------------------------------------
+Iter:     1 I:  0 Tm:      0.03 NLPi:   18 Dpth:    0 Lvs:    3 Obj:  2.39E+02 Gap:       NaN
+Iter:     2 I: -1 Tm:      0.01 NLPi:    1 Dpth:    1 Lvs:    2 Obj:  2.39E+02 Gap:       NaN
+Iter:     3 I:  0 Tm:      0.02 NLPi:   11 Dpth:    2 Lvs:    4 Obj:  1.97E+02 Gap:       NaN
+--Integer Solution:   2.00E+02 Lowest Leaf:   1.97E+02 Gap:   1.50E-02
+Iter:     4 I:  0 Tm:      0.04 NLPi:    3 Dpth:    2 Lvs:    3 Obj:  2.00E+02 Gap:  1.50E-02
+ Successful solution
+"""
+
+    def test_apopt_output_expect_parsed_convergence_data(self):
+        telemetry = SolverTelemetry.from_apopt_output(self.APOPT_OUTPUT)
+        self.assertTrue(telemetry.is_successful)
+        self.assertEqual(4, telemetry.nodes)
+        self.assertEqual(33, telemetry.nlp_iterations)
+        self.assertEqual(2, telemetry.max_depth)
+        self.assertEqual(1, telemetry.integer_solution_count)
+        self.assertEqual(1, telemetry.nodes_after_first_integer_solution)
+        self.assertEqual(200.0, telemetry.best_integer_objective)
+        self.assertEqual(197.0, telemetry.best_bound)
+        self.assertEqual(0.015, telemetry.gap)
+        self.assertAlmostEqual(0.06, telemetry.time_to_first_integer_solution)
+        self.assertAlmostEqual(0.1, telemetry.solve_time)
+
+    def test_failed_solve_expect_status_without_integer_solution(self):
+        telemetry = SolverTelemetry.from_apopt_output(
+            "Iter:     1 I: -1 Tm:      0.07 NLPi:   25 Dpth:    0 Lvs:    0 Obj:  0.00E+00 Gap:       NaN\n"
+            " Maximum iterations\n")
+        self.assertFalse(telemetry.is_successful)
+        self.assertEqual('Maximum iterations', telemetry.status)
+        self.assertIsNone(telemetry.gap)
+        self.assertIsNone(telemetry.time_to_first_integer_solution)
+
+    def test_reached_limits_expect_exhausted_iteration_limits_only(self):
+        telemetry = SolverTelemetry.from_apopt_output(self.APOPT_OUTPUT)
+        self.assertEqual([], telemetry.reached_limits(AttributeSkillOptimizer.DEFAULT_SOLVER_OPTIONS))
+        self.assertEqual(['minlp_max_iter_with_int_sol'],
+                         telemetry.reached_limits(('minlp_maximum_iterations 5', 'minlp_max_iter_with_int_sol 1')))
+
+    def test_optimize_selection_expect_telemetry_of_minlp_solves_in_result_and_trace_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            trace_file_name = os.path.join(directory, 'trace.jsonl')
+            optimizer = AttributeSkillOptimizer(tier=1, telemetry_trace_file=trace_file_name)
+            minlp_result = optimizer.optimize_selection({"BallisticSkill": 4, "Stealth": 5})
+            closed_form_result = optimizer.optimize_selection({"Stealth": 5})
+            with open(trace_file_name, 'r') as trace_file:
+                records = [json.loads(line) for line in trace_file]
+
+        self.assertTrue(minlp_result.solver_telemetry.is_successful)
+        self.assertGreater(minlp_result.solver_telemetry.nodes, 0)
+        self.assertIsNone(closed_form_result.solver_telemetry)
+        self.assertEqual(['minlp', 'closed_form'], [record['solver'] for record in records])
+        self.assertEqual(minlp_result.XPCost.Total, records[0]['xp_cost'])
+        self.assertEqual(minlp_result.solver_telemetry.nodes, records[0]['telemetry']['nodes'])
+        self.assertIsNone(records[1]['telemetry'])
+
+    def test_failed_minlp_expect_depth_first_search_fallback_in_trace_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            trace_file_name = os.path.join(directory, 'trace.jsonl')
+            optimizer = AttributeSkillOptimizer(tier=1, telemetry_trace_file=trace_file_name)
+            with patch.object(optimizer, '_solve_minlp', side_effect=MinlpSolveError('@error: Solution Not Found')):
+                result = optimizer.optimize_selection({"BallisticSkill": 4, "Stealth": 5})
+            with open(trace_file_name, 'r') as trace_file:
+                record = json.loads(trace_file.readline())
+
+        self.assertEqual('dfs_fallback', optimizer.last_solver_path)
+        self.assertEqual('dfs_fallback', record['solver'])
+        self.assertEqual(result.XPCost.Total, record['xp_cost'])
+
+    def test_unwritable_trace_file_expect_result_and_logged_warning(self):
+        with tempfile.TemporaryDirectory() as directory:
+            optimizer = AttributeSkillOptimizer(
+                tier=1, telemetry_trace_file=os.path.join(directory, 'nonexistent', 'trace.jsonl'))
+            with self.assertLogs('xpOptimizer', level='WARNING'):
+                result = optimizer.optimize_selection({"Stealth": 5})
+        self.assertFalse(any(result.Skills.Missed))
+
+
 class TestAttributeSkillOptimizer(unittest.TestCase):
     def run_positive_tests_on_optimized_selection(self, selection: IntendedSelection) -> AttributeSkillOptimizerResults:
         optimizer = AttributeSkillOptimizer(tier=selection.tier)
@@ -73,7 +269,8 @@ class TestAttributeSkillOptimizer(unittest.TestCase):
                                                        "BallisticSkill": 7,
                                                        "Cunning": 2,
                                                        "Stealth": 10},
-                                        expected_xp_cost=XPCost(attribute_costs=45, skill_costs=50)),
+                                        # Equal total to the former MINLP result of 45 + 50 XP.
+                                        expected_xp_cost=XPCost(attribute_costs=39, skill_costs=56)),
                       IntendedSelection(tier=2,
                                         target_values={"Strength": 5,
                                                        "Toughness": 5,
@@ -81,7 +278,8 @@ class TestAttributeSkillOptimizer(unittest.TestCase):
                                                        "BallisticSkill": 2,
                                                        "Survival": 4,
                                                        "WeaponSkill": 8},
-                                        expected_xp_cost=XPCost(attribute_costs=84, skill_costs=42))]
+                                        # Solved in closed form, the MINLP only found 84 + 42 XP.
+                                        expected_xp_cost=XPCost(attribute_costs=94, skill_costs=30))]
         for selection_id, selection in enumerate(selections):
             with self.subTest(i=selection_id):
                 self.run_positive_tests_on_optimized_selection(selection)
@@ -115,7 +313,8 @@ class TestAttributeSkillOptimizer(unittest.TestCase):
                                                      "Stealth": 13,
                                                      "Defence": 6,
                                                      "MaxWounds": 10},
-                                      expected_xp_cost=XPCost(attribute_costs=190, skill_costs=116))
+                                      # The MINLP alone only found 190 + 116 XP.
+                                      expected_xp_cost=XPCost(attribute_costs=200, skill_costs=98))
         result = self.run_positive_tests_on_optimized_selection(selection)
 
         for extension, formatter in zip(["md", "json"], [lambda x: str(x), lambda x: json.dumps(dict(x), indent=2)]):
@@ -129,6 +328,191 @@ class TestAttributeSkillOptimizer(unittest.TestCase):
             #     expected_results_file.write(formatter(result))
 
 
+class TestPresolve(unittest.TestCase):
+    # Not closed-form solvable: Several skill targets per attribute.
+    MINLP_TARGET_VALUES = {"Investigation": 13, "Persuasion": 9, "Insight": 9, "Tech": 14, "Intimidation": 7,
+                           "Stealth": 11, "Pilot": 16, "Awareness": 6, "PsychicMastery": 5, "Intellect": 3,
+                           "Fellowship": 6}
+
+    def test_presolve_expect_folded_attribute_targets_and_dominated_skill_targets_dropped(self):
+        optimizer = AttributeSkillOptimizer(tier=2)
+        presolved_targets = optimizer.presolve({"Toughness": 3, "MaxWounds": 9, "Resilience": 6, "Strength": 3,
+                                                "Athletics": 3, "Stealth": 12})
+        self.assertEqual({Attributes.Strength: 3, Attributes.Toughness: 5}, presolved_targets.attribute_targets)
+        self.assertEqual({Skills.Stealth: 12}, presolved_targets.skill_targets)
+        self.assertEqual(4, presolved_targets.attribute_bounds[Attributes.Agility].min)
+        self.assertTrue(presolved_targets.is_closed_form_solvable)
+
+    def test_presolve_with_several_skill_targets_per_attribute_expect_not_closed_form_solvable(self):
+        optimizer = AttributeSkillOptimizer(tier=1)
+        self.assertFalse(optimizer.presolve({"BallisticSkill": 4, "Stealth": 5}).is_closed_form_solvable)
+
+    def test_trait_only_targets_expect_attributes_at_lower_bound_without_solve(self):
+        optimizer = AttributeSkillOptimizer(tier=1)
+        result = optimizer.optimize_selection({"MaxWounds": 5, "Defence": 2})
+        self.assertIsNone(optimizer.last_resource_usage)
+        self.assertEqual(3, result.Attributes.Total[Attributes.Toughness.name])
+        self.assertEqual(3, result.Attributes.Total[Attributes.Initiative.name])
+        self.assertEqual(XPCost(attribute_costs=20, skill_costs=0), result.XPCost)
+
+    def test_closed_form_expect_not_more_expensive_than_minlp(self):
+        target_values = {"Strength": 4, "Athletics": 9, "Awareness": 6, "WeaponSkill": 7, "Persuasion": 5}
+        optimizer = AttributeSkillOptimizer(tier=2)
+        presolved_targets = optimizer.presolve(target_values)
+        attribute_ratings, skill_ratings = optimizer._solve_closed_form(presolved_targets)
+        minlp_attribute_ratings, minlp_skill_ratings = optimizer._solve_minlp(presolved_targets)
+        minlp_xp_cost = optimizer._get_xp_cost({**minlp_attribute_ratings, **minlp_skill_ratings})
+
+        result = optimizer.optimize_selection(target_values)
+        self.assertFalse(any(result.Skills.Missed))
+        self.assertGreaterEqual(sum(rating > 0 for rating in skill_ratings.values()), max(skill_ratings.values()))
+        self.assertLessEqual(result.XPCost.Total, minlp_xp_cost.Total)
+
+    def test_minlp_selection_expect_not_more_expensive_than_before_presolve(self):
+        # Cost of the MINLP with the original formulation (before the presolve was introduced).
+        baseline_xp_cost = 609
+        result = AttributeSkillOptimizer(tier=4).optimize_selection(
+            {"Persuasion": 8, "Insight": 16, "Pilot": 10, "BallisticSkill": 5, "Tech": 16, "PsychicMastery": 4,
+             "Scholar": 13, "Medicae": 14, "Deception": 15, "Agility": 6})
+        self.assertFalse(any(result.Skills.Missed))
+        self.assertLessEqual(result.XPCost.Total, baseline_xp_cost)
+
+    def test_interchangeable_skill_groups_expect_equal_targets_per_attribute_and_untargeted_skills(self):
+        optimizer = AttributeSkillOptimizer(tier=1)
+        groups = optimizer.presolve({"Cunning": 5, "Deception": 5, "Insight": 6}).interchangeable_skill_groups
+        self.assertIn([Skills.Cunning, Skills.Deception], groups)
+        untargeted_skills = [skill for skill in Skills.get_valid_members()
+                             if skill not in [Skills.Cunning, Skills.Deception, Skills.Insight]]
+        self.assertIn(untargeted_skills, groups)
+        self.assertEqual(2, len(groups))
+
+    def test_minlp_selection_expect_canonical_order_of_interchangeable_skills(self):
+        target_values = {"Cunning": 5, "Deception": 5, "Insight": 8, "Stealth": 7, "Pilot": 6}
+        optimizer = AttributeSkillOptimizer(tier=2)
+        result = optimizer.optimize_selection(target_values)
+        self.assertIsNotNone(optimizer.last_resource_usage)
+        for skills in optimizer.presolve(target_values).interchangeable_skill_groups:
+            ratings = [result.Skills.Rating[skill.name] for skill in skills]
+            self.assertEqual(sorted(ratings, reverse=True), ratings)
+
+    def test_failed_minlp_expect_optimal_selection_of_depth_first_search(self):
+        target_values = self.MINLP_TARGET_VALUES
+        # APOPT fails with a single NLP iteration per node (it also did with the default options before the presolved
+        # bounds were passed to the MINLP).
+        failing_solver_options = tuple(option for option in AttributeSkillOptimizer.DEFAULT_SOLVER_OPTIONS
+                                       if not option.startswith('nlp_maximum_iterations')) \
+            + ('nlp_maximum_iterations 1',)
+        for solver_options in [AttributeSkillOptimizer.DEFAULT_SOLVER_OPTIONS, failing_solver_options]:
+            with self.subTest(solver_options=solver_options):
+                optimizer = AttributeSkillOptimizer(tier=2, solver_options=solver_options)
+                result = optimizer.optimize_selection(target_values)
+                self.assertEqual(solver_options != failing_solver_options, result.solver_telemetry.is_successful)
+                self.assertFalse(any(result.Attributes.Missed) or any(result.Skills.Missed))
+                self.assertEqual(502, result.XPCost.Total)
+                self.assertIsNone(next(optimizer._enumerate_ratings(optimizer.presolve(target_values),
+                                                                    result.XPCost.Total - 1), None))
+
+    def test_failed_minlp_without_remaining_solve_time_expect_solve_error(self):
+        optimizer = AttributeSkillOptimizer(tier=2, max_solve_time=0)
+        with patch.object(optimizer, '_solve_minlp', side_effect=MinlpSolveError('@error: Solution Not Found')):
+            with self.assertRaises(MinlpSolveError):
+                optimizer.optimize_selection(self.MINLP_TARGET_VALUES)
+
+    def test_exceeded_solve_time_in_descent_expect_timeout_error(self):
+        optimizer = AttributeSkillOptimizer(tier=2, max_solve_time=0)
+        presolved_targets = optimizer.presolve(self.MINLP_TARGET_VALUES)
+        suboptimal_ratings = next(optimizer._enumerate_ratings(presolved_targets,
+                                                               optimizer._get_max_cost(presolved_targets)))
+        with patch.object(optimizer, '_solve_minlp', return_value=suboptimal_ratings):
+            with self.assertRaises(TimeoutError):
+                optimizer.optimize_selection(self.MINLP_TARGET_VALUES)
+
+    def test_model_building_error_expect_error_without_fallback(self):
+        optimizer = AttributeSkillOptimizer(tier=2)
+        with patch.object(optimizer, '_create_gekko_var', side_effect=ValueError('invalid bounds')), \
+                patch.object(optimizer, '_enumerate_ratings') as enumerate_ratings:
+            with self.assertRaises(ValueError):
+                optimizer.optimize_selection(self.MINLP_TARGET_VALUES)
+        enumerate_ratings.assert_not_called()
+
+
+class TestEnumerateOptimalSelections(unittest.TestCase):
+    def test_enumerate_optimal_selections_expect_distinct_selections_with_optimal_cost(self):
+        optimizer = AttributeSkillOptimizer(tier=1)
+        target_values = {"Athletics": 3}
+        results = list(optimizer.enumerate_optimal_selections(target_values, max_extra_xp=2))
+
+        # Optimal: Strength 2 & Athletics 1. Within +2 XP: One more skill at 1 or Strength 1, Athletics 2 & filler.
+        self.assertEqual(1 + 2 * (len(list(Skills.get_valid_members())) - 1), len(results))
+        self.assertEqual(len(results), optimizer.count_optimal_selections(target_values, max_extra_xp=2))
+        self.assertEqual(len(results), len({json.dumps(dict(result)) for result in results}))
+        self.assertEqual(1, sum(result.XPCost.Total == 6 for result in results))
+        for result in results:
+            self.assertFalse(any(result.Skills.Missed))
+            self.assertLessEqual(result.XPCost.Total, 8)
+            ratings = result.Skills.Rating.values()
+            self.assertGreaterEqual(sum(rating > 0 for rating in ratings), max(ratings))
+
+    def test_enumerate_optimal_selections_with_max_count_expect_at_most_max_count_results(self):
+        optimizer = AttributeSkillOptimizer(tier=1)
+        results = list(optimizer.enumerate_optimal_selections({"Athletics": 3}, max_extra_xp=2, max_count=5))
+        self.assertEqual(5, len(results))
+
+    def test_enumerate_optimal_selections_expect_not_more_expensive_than_optimize_selection(self):
+        optimizer = AttributeSkillOptimizer(tier=1)
+        target_values = {"Athletics": 5, "Awareness": 3, "BallisticSkill": 7, "Cunning": 2, "Stealth": 10}
+        optimal_cost = optimizer.optimize_selection(target_values).XPCost.Total
+        costs = {result.XPCost.Total for result in optimizer.enumerate_optimal_selections(target_values)}
+        self.assertEqual(1, len(costs))
+        self.assertLessEqual(costs.pop(), optimal_cost)
+
+    def test_invalid_names_expect_IOError(self):
+        optimizer = AttributeSkillOptimizer(tier=1)
+        with self.assertRaises(IOError):
+            list(optimizer.enumerate_optimal_selections({"Bogus": 3}))
+        with self.assertRaises(IOError):
+            optimizer.count_optimal_selections({"Bogus": 3})
+        with self.assertRaises(IOError):
+            optimizer.count_optimal_selections({"Stealth": 3}, current_ratings={"Bogus": 1})
+
+
+class TestCurrentRatings(unittest.TestCase):
+    def test_current_ratings_without_targets_expect_kept_ratings_and_0_cost(self):
+        current_ratings = {"Willpower": 3, "Leadership": 2, "Survival": 1}
+        result = AttributeSkillOptimizer(tier=1).optimize_selection(dict(), current_ratings=current_ratings)
+        self.assertEqual(3, result.Attributes.Total["Willpower"])
+        self.assertEqual(2, result.Skills.Rating["Leadership"])
+        self.assertEqual(XPCost(attribute_costs=0, skill_costs=0), result.XPCost)
+        self.assertEqual(dict(), result.Purchases.New)
+
+    def test_current_ratings_expect_additional_xp_and_purchases_only(self):
+        target_values = {"Strength": 4, "Athletics": 6, "Stealth": 5, "Pilot": 3}
+        current_ratings = {"Strength": 2, "Agility": 2, "Stealth": 1}
+        for selection_target_values in [{"Strength": 4, "Athletics": 6}, target_values]:
+            with self.subTest(i=selection_target_values):
+                optimizer = AttributeSkillOptimizer(tier=1)
+                result = optimizer.optimize_selection(selection_target_values, current_ratings)
+                self.assertFalse(any(result.Attributes.Missed) or any(result.Skills.Missed))
+                new_ratings = {**result.Attributes.Total, **result.Skills.Rating}
+                for name, rating in current_ratings.items():
+                    self.assertGreaterEqual(new_ratings[name], rating)
+
+                full_cost = optimizer._get_xp_cost(new_ratings).Total
+                self.assertEqual(full_cost - optimizer._get_xp_cost(current_ratings).Total, result.XPCost.Total)
+                self.assertEqual(result.XPCost.Total, sum(result.Purchases.XPCost.values()))
+                self.assertEqual({name for name, rating in new_ratings.items()
+                                  if rating > current_ratings.get(name, 1 if name in Attributes.__members__ else 0)},
+                                 set(result.Purchases.New))
+                self.assertEqual(dict(result), CompactResults.from_results(result).to_dict())
+                self.assertIn('## Purchases', str(result))
+
+    def test_invalid_current_ratings_expect_IOError(self):
+        for current_ratings in [{"Strength": 0}, {"Athletics": 9}, {"MaxWounds": 3}, {"Athletics": "1"}]:
+            with self.subTest(i=current_ratings):
+                with self.assertRaises(IOError):
+                    AttributeSkillOptimizer(tier=1).optimize_selection(dict(), current_ratings)
+
+
 class TestIsValidTargetValuesDict(unittest.TestCase):
     @staticmethod
     def get_minimal_valid_target_values() -> Dict[str, int]:
@@ -195,5 +579,27 @@ class TestIsValidTargetValuesDict(unittest.TestCase):
                                      value_bounds=Traits.MaxWounds.value.get_rating_bounds(related_tier=1))
 
 
+class TestGetCanonicalNames(unittest.TestCase):
+    def test_full_and_short_names_expect_enum_names(self):
+        self.assertEqual({"Tier": 2, "BallisticSkill": 5, "Agility": 3, "MaxWounds": 8},
+                         get_canonical_names({"Tier": 2, "Ballistic Skill": 5, "A": 3, "Max Wounds": 8}))
+
+    def test_unknown_and_duplicate_names_expect_kept(self):
+        self.assertEqual({"Test": 1, "A": 3, "Agility": 4}, get_canonical_names({"Test": 1, "A": 3, "Agility": 4}))
+
+
+class TestVectors(unittest.TestCase):
+    def test_target_vector_expect_target_values_without_zero_entries(self):
+        target_values = {"Tier": 3, "Agility": 5, "BallisticSkill": 11, "MaxWounds": 10}
+        target_vector = [target_values.get(name, 0) for name in TARGET_VECTOR_NAMES]
+        self.assertEqual(target_values, get_target_values_from_vector(target_vector))
+
+    def test_wrong_vector_length_expect_IOError(self):
+        with self.assertRaises(IOError):
+            get_target_values_from_vector([1, 2])
+        with self.assertRaises(IOError):
+            get_current_ratings_from_vector([1] * 7)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,212 @@
+import json
+import threading
+import time
+import unittest
+from typing import List
+from unittest.mock import patch, Mock
+
+import xpOptimizer
+from xpOptimizerService import AdmissionController, AdmissionRejected, canonicalize_json_object, get_etag, app, \
+    get_cost_class, VECTOR_CONTENT_TYPE, CACHE_CONTROL
+
+
+class TestAdmissionController(unittest.TestCase):
+    def setUp(self):
+        self.controller = AdmissionController(max_concurrent_solves=1,
+                                              max_queue_length=4,
+                                              max_queued_per_client=2,
+                                              max_queue_wait=5)
+        self.admission_order: List[str] = []
+
+    def queue_request(self, client_id: str, cost_class: int, name: str) -> threading.Thread:
+        def run():
+            with self.controller.admit(client_id, cost_class):
+                self.admission_order.append(name)
+
+        queued_count = self.controller.get_state()['queued']
+        thread = threading.Thread(target=run)
+        thread.start()
+        while self.controller.get_state()['queued'] == queued_count:
+            time.sleep(0.001)
+        return thread
+
+    def run_queued_requests(self, requests) -> List[str]:
+        with self.controller.admit('blocker', 0):
+            threads = [self.queue_request(*queued_request) for queued_request in requests]
+        for thread in threads:
+            thread.join()
+        return self.admission_order
+
+    def test_waiting_requests_expect_cheap_before_heavy_in_arrival_order(self):
+        order = self.run_queued_requests([('a', 1, 'heavy'), ('b', 0, 'cheap_1'), ('c', 0, 'cheap_2')])
+        self.assertEqual(['cheap_1', 'cheap_2', 'heavy'], order)
+
+    def test_full_queue_expect_rejection_with_retry_after(self):
+        with self.controller.admit('blocker', 0):
+            threads = [self.queue_request(f"client_{i}", 0, str(i)) for i in range(self.controller.max_queue_length)]
+            with self.assertRaises(AdmissionRejected) as context:
+                with self.controller.admit('late', 0):
+                    pass
+            self.assertGreaterEqual(context.exception.retry_after, 1)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, self.controller.metrics.rejected)
+
+    def test_used_up_client_share_expect_rejection_for_that_client_only(self):
+        with self.controller.admit('blocker', 0):
+            threads = [self.queue_request('greedy', 0, str(i)) for i in range(self.controller.max_queued_per_client)]
+            with self.assertRaises(AdmissionRejected):
+                with self.controller.admit('greedy', 0):
+                    pass
+            threads.append(self.queue_request('other', 0, 'other'))
+        for thread in threads:
+            thread.join()
+        self.assertIn('other', self.admission_order)
+
+    def test_admitted_requests_expect_wait_time_in_metrics(self):
+        self.run_queued_requests([('a', 0, 'a')])
+        self.assertEqual(2, self.controller.metrics.admitted)
+        self.assertGreater(self.controller.metrics.max_wait_time, 0)
+
+
+class TestGetCostClass(unittest.TestCase):
+    def test_current_ratings_meeting_skill_targets_expect_cheap_request(self):
+        target_values = {"Tier": 1, "BallisticSkill": 4, "Stealth": 5, "Athletics": 3, "Awareness": 3}
+        self.assertEqual(1, get_cost_class(target_values))
+        self.assertEqual(0, get_cost_class(target_values, current_ratings={"Agility": 5}))
+
+
+class TestCanonicalizeJsonObject(unittest.TestCase):
+    def test_equivalent_target_values_expect_same_canonical_representation_and_etag(self):
+        target_values, canonical_target_values = canonicalize_json_object('{"Tier": 2, "Ballistic Skill": 5, "A": 3}')
+        other_target_values, other_canonical_target_values = canonicalize_json_object(
+            '{"Agility":3,"BallisticSkill":5,"Tier":2}')
+        self.assertEqual({"Tier": 2, "BallisticSkill": 5, "Agility": 3}, target_values)
+        self.assertEqual(canonical_target_values, other_canonical_target_values)
+        self.assertEqual(get_etag(canonical_target_values), get_etag(other_canonical_target_values))
+
+    def test_non_object_expect_value_error(self):
+        with self.assertRaises(ValueError):
+            canonicalize_json_object('[1, 2]')
+
+
+class TestOptimizeXpCaching(unittest.TestCase):
+    TARGET_VALUES = {"Tier": 2, "Agility": 3, "Stealth": 6}
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def get_optimize_xp(self, target_values, headers=None):
+        return self.client.get('/optimize_xp', query_string={'target_values': json.dumps(target_values)},
+                               headers=headers)
+
+    def test_result_expect_etag_and_cache_control(self):
+        response = self.get_optimize_xp(self.TARGET_VALUES)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(get_etag(canonicalize_json_object(json.dumps(self.TARGET_VALUES))[1]),
+                         response.get_etag()[0])
+        self.assertEqual(CACHE_CONTROL, response.headers['Cache-Control'])
+
+    def test_matching_if_none_match_expect_304_without_solve(self):
+        etag = self.get_optimize_xp(self.TARGET_VALUES).get_etag()[0]
+        with patch.object(xpOptimizer, 'optimize_xp') as optimize_xp:
+            response = self.get_optimize_xp(self.TARGET_VALUES, headers={'If-None-Match': f'"{etag}"'})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(etag, response.get_etag()[0])
+        self.assertEqual(CACHE_CONTROL, response.headers['Cache-Control'])
+        optimize_xp.assert_not_called()
+
+    def test_other_target_values_or_version_expect_other_etag(self):
+        etag = self.get_optimize_xp(self.TARGET_VALUES).get_etag()[0]
+        self.assertNotEqual(etag, self.get_optimize_xp({**self.TARGET_VALUES, "Stealth": 7}).get_etag()[0])
+        with patch.object(xpOptimizer, '__version__', xpOptimizer.__version__ + 0.1):
+            self.assertNotEqual(etag, self.get_optimize_xp(self.TARGET_VALUES).get_etag()[0])
+
+
+class TestTelemetryTraceFile(unittest.TestCase):
+    def test_unwritable_trace_file_expect_result(self):
+        with patch('xpOptimizerService.TELEMETRY_TRACE_FILE', '/nonexistent/dir/trace.jsonl'):
+            response = app.test_client().get('/optimize_xp', query_string={
+                'target_values': json.dumps({"Tier": 1, "BallisticSkill": 4, "Stealth": 5})})
+        self.assertEqual(200, response.status_code)
+
+
+class TestOptimizerError(unittest.TestCase):
+    def test_optimizer_exception_expect_logged_error_and_500(self):
+        with patch.object(xpOptimizer, 'optimize_xp', side_effect=RuntimeError("solver crashed")), \
+                self.assertLogs(app.logger, level='ERROR') as logs:
+            response = app.test_client().get('/optimize_xp', query_string={
+                'target_values': json.dumps({"Tier": 1, "Stealth": 5})})
+        self.assertEqual(500, response.status_code)
+        self.assertIn('RuntimeError: solver crashed', logs.output[0])
+
+
+class TestWorkerRecycling(unittest.TestCase):
+    def get_metrics_with_exceeded_thresholds(self, is_recycling_enabled: bool) -> Mock:
+        usage = xpOptimizer.SolveResourceUsage(solve_count=2)
+        with patch.object(xpOptimizer.GekkoContext, 'cumulative_usage', usage), \
+                patch('xpOptimizerService.WORKER_RECYCLE_THRESHOLDS', xpOptimizer.SolveResourceUsage(solve_count=1)), \
+                patch('xpOptimizerService.IS_WORKER_RECYCLING_ENABLED', is_recycling_enabled), \
+                patch('xpOptimizerService.os.kill') as kill:
+            response = app.test_client().get('/metrics')
+            response.close()
+        self.assertEqual(200, response.status_code)
+        return kill
+
+    def test_exceeded_thresholds_without_recycling_expect_no_termination(self):
+        self.get_metrics_with_exceeded_thresholds(is_recycling_enabled=False).assert_not_called()
+
+    def test_exceeded_thresholds_with_recycling_expect_termination_after_response(self):
+        self.get_metrics_with_exceeded_thresholds(is_recycling_enabled=True).assert_called_once()
+
+
+class TestOptimizeXpVectors(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+
+    @staticmethod
+    def get_target_vector(target_values) -> List[int]:
+        return [target_values.get(name, 0) for name in xpOptimizer.TARGET_VECTOR_NAMES]
+
+    def post_rows(self, rows, content_type: str = VECTOR_CONTENT_TYPE):
+        return self.client.post('/optimize_xp', data=json.dumps(rows), content_type=content_type)
+
+    def test_target_vectors_expect_result_vectors_matching_name_keyed_results(self):
+        target_values = {"Tier": 2, "Agility": 3, "Stealth": 6}
+        current_ratings = {name: 0 for name in xpOptimizer.CURRENT_RATINGS_VECTOR_NAMES}
+        current_ratings.update({"Strength": 1, "Toughness": 1, "Agility": 2, "Initiative": 1, "Willpower": 1,
+                                "Intellect": 1, "Fellowship": 1, "Stealth": 1})
+        target_vector = self.get_target_vector(target_values)
+        response = self.post_rows([target_vector, target_vector + list(current_ratings.values())])
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(VECTOR_CONTENT_TYPE, response.mimetype)
+        result_vectors = json.loads(response.get_data())
+        expected_results = [xpOptimizer.optimize_xp(dict(target_values)),
+                            xpOptimizer.optimize_xp(dict(target_values), current_ratings=current_ratings)]
+        for result_vector, expected_result in zip(result_vectors, expected_results):
+            self.assertEqual(2, result_vector[0])
+            self.assertEqual(list(expected_result.Attributes.Total.values()), result_vector[1:8])
+            self.assertEqual(list(expected_result.Skills.Rating.values()), result_vector[8:26])
+            self.assertEqual([expected_result.XPCost.Attributes, expected_result.XPCost.Skills], result_vector[-2:])
+
+    def test_batch_expect_one_admission_per_row(self):
+        controller = AdmissionController(max_concurrent_solves=1)
+        with patch('xpOptimizerService.admission_controller', controller):
+            response = self.post_rows([self.get_target_vector({"Tier": 1, "Stealth": 5})] * 3)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3, controller.metrics.admitted)
+        self.assertEqual(3, controller.metrics.completed)
+
+    def test_other_content_type_expect_415(self):
+        self.assertEqual(415, self.post_rows([self.get_target_vector({"Tier": 1})], 'application/json').status_code)
+
+    def test_invalid_rows_expect_400(self):
+        for rows in [{"Tier": 1}, [[1, 2, 3]], [self.get_target_vector({"Tier": 1, "Stealth": 30})],
+                     [self.get_target_vector({"Tier": 0})], [self.get_target_vector({"Tier": 1}) + [1]]]:
+            with self.subTest(rows=rows):
+                self.assertEqual(400, self.post_rows(rows).status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,26 +1,254 @@
-__version__ = 1.5
+from __future__ import annotations
+
+__version__ = 1.6
 
 import argparse
 import json
+import logging
+import math
 import os
-from typing import Optional, Dict, Union, List, Tuple, Type
+import re
+import shutil
+import sys
+import threading
+import time
+from dataclasses import dataclass, asdict
+from itertools import islice
+from typing import Optional, Dict, Union, List, Tuple, Type, Iterator, Sequence, Iterable, TextIO
 
 import numpy as np
 from gekko import GEKKO
 
-from characterProperties import Tier, Attributes, Skills, Traits, IntBounds
-from xpOptimizerResults import CharacterPropertyResults, SkillResults, XPCost, AttributeSkillOptimizerResults
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from characterProperties import Tier, Attributes, Skills, Traits, IntBounds, Skill
+from xpOptimizerResults import CharacterPropertyResults, SkillResults, XPCost, AttributeSkillOptimizerResults, \
+    CompactResults, PurchaseResults, RESULT_WRITERS
+
+
+class MinlpSolveError(Exception):
+    """
+    APOPT found no solution (e.g. '@error: Solution Not Found') or exceeded the max. solve time.
+    """
+
+
+@dataclass
+class SolveResourceUsage:
+    """
+    Resources consumed by one or more solves. Memory values are in kB (as reported by `getrusage` on Linux).
+
+    Note: `child_cpu_time` & `peak_rss_delta` are taken from the process-wide `getrusage`, so solves which overlap in
+    one process (e.g. in a threaded worker) are attributed each other's child CPU time & memory growth.
+    """
+    solve_count: int = 0
+    wall_time: float = 0.0
+    child_cpu_time: float = 0.0
+    peak_rss_delta: int = 0
+    temp_file_bytes: int = 0
+
+    def __add__(self, other: SolveResourceUsage) -> SolveResourceUsage:
+        return SolveResourceUsage(**{name: value + getattr(other, name) for name, value in asdict(self).items()})
+
+    def exceeds(self, thresholds: SolveResourceUsage) -> List[str]:
+        """
+        :param thresholds: The limits to check against; non-positive values are ignored.
+        :return: The names of all counters that are above their (positive) threshold.
+        """
+        return [name for name, limit in asdict(thresholds).items() if 0 < limit < getattr(self, name)]
+
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_TRACE_LOCK = threading.Lock()  # Serializes appends to telemetry trace files of concurrent solves
+
+
+@dataclass
+class SolverTelemetry:
+    """
+    Convergence data of one APOPT solve, parsed from its iteration log. Each branch & bound iteration is one node.
+    """
+    status: str  # Final message of APOPT, e.g. 'Successful solution' or 'Maximum iterations'
+    nodes: int = 0
+    nlp_iterations: int = 0
+    max_depth: int = 0
+    integer_solution_count: int = 0
+    nodes_after_first_integer_solution: int = 0
+    best_integer_objective: Optional[float] = None
+    best_bound: Optional[float] = None  # Lowest open leaf at the last integer solution
+    gap: Optional[float] = None
+    solve_time: float = 0.0
+    time_to_first_integer_solution: Optional[float] = None
+
+    ITERATION_PATTERN = re.compile(r"Iter:\s*\d+\s+I:\s*(-?\d+)\s+Tm:\s*(\S+)\s+NLPi:\s*(\d+)\s+Dpth:\s*(\d+)"
+                                   r"\s+Lvs:\s*\d+\s+Obj:\s*(\S+)\s+Gap:\s*(\S+)")
+    INTEGER_SOLUTION_PATTERN = re.compile(r"--Integer Solution:\s*(\S+)\s+Lowest Leaf:\s*(\S+)\s+Gap:\s*(\S+)")
+
+    @property
+    def is_successful(self) -> bool:
+        return self.status == 'Successful solution'
+
+    @classmethod
+    def from_apopt_output(cls, output: str) -> SolverTelemetry:
+        telemetry = cls(status='')
+        for line in output.splitlines():
+            if (match := cls.ITERATION_PATTERN.search(line)) is not None:
+                telemetry.nodes += 1
+                telemetry.solve_time += float(match.group(2))
+                telemetry.nlp_iterations += int(match.group(3))
+                telemetry.max_depth = max(telemetry.max_depth, int(match.group(4)))
+                telemetry.nodes_after_first_integer_solution += telemetry.integer_solution_count > 0
+                telemetry.gap = cls._to_float(match.group(6))
+            elif (match := cls.INTEGER_SOLUTION_PATTERN.search(line)) is not None:
+                if telemetry.integer_solution_count == 0:
+                    telemetry.time_to_first_integer_solution = telemetry.solve_time
+                telemetry.integer_solution_count += 1
+                telemetry.best_integer_objective = cls._to_float(match.group(1))
+                telemetry.best_bound = cls._to_float(match.group(2))
+                telemetry.gap = cls._to_float(match.group(3))
+            elif line.strip() and not line.strip().startswith('-') and 'APOPT Solver' not in line:
+                telemetry.status = line.strip()
+        return telemetry
+
+    def reached_limits(self, solver_options: Sequence[str]) -> List[str]:
+        """
+        :param solver_options: APOPT options, e.g. 'minlp_maximum_iterations 500'.
+        :return: The names of the MINLP iteration limits, which stopped the solve.
+        """
+        limits = dict(option.split()[:2] for option in solver_options if len(option.split()) >= 2)
+        node_counts = {'minlp_maximum_iterations': self.nodes,
+                       'minlp_max_iter_with_int_sol': self.nodes_after_first_integer_solution}
+        return [name for name, node_count in node_counts.items() if name in limits and node_count >= int(limits[name])]
+
+    @staticmethod
+    def _to_float(value: str) -> Optional[float]:
+        try:
+            number = float(value)
+        except ValueError:
+            return None
+        return None if math.isnan(number) else number
 
 
 class GekkoContext:
-    def __init__(self, *args, **kwargs):
+    """
+    Creates a GEKKO solver & guarantees the removal of its temp. directory (also on exceptions & timeouts). The
+    resources of each solve are stored in `usage` and summed up over all contexts in `cumulative_usage`. The
+    convergence data of APOPT solves is stored in `telemetry`.
+    """
+    cumulative_usage: SolveResourceUsage = SolveResourceUsage()
+    _cumulative_usage_lock = threading.Lock()  # Concurrent solves (threaded workers) must not lose updates.
+
+    def __init__(self, *args, max_time: Optional[float] = None, **kwargs):
         self.solver = GEKKO(*args, **kwargs)
+        if max_time is not None:
+            # GEKKO kills the solver process if it exceeds this limit (local solves).
+            self.solver.options.MAX_TIME = max_time
+        self.usage: Optional[SolveResourceUsage] = None
+        self.telemetry: Optional[SolverTelemetry] = None
+        self._start_time: float = 0.0
+        self._start_rusage: Tuple[float, int] = (0.0, 0)
 
     def __enter__(self):
+        self._start_time = time.perf_counter()
+        self._start_rusage = self._get_rusage()
         return self.solver
 
     def __exit__(self, exec_type, exec_value, exec_traceback):
-        self.solver.cleanup()
+        try:
+            temp_file_bytes = self._get_directory_size(self.solver._path)
+            self.telemetry = self._read_telemetry(self.solver._path)
+            self.solver.cleanup()
+        finally:
+            # GEKKO's cleanup swallows errors, so make sure nothing is left behind.
+            shutil.rmtree(self.solver._path, ignore_errors=True)
+
+        child_cpu_time, max_rss = self._get_rusage()
+        self.usage = SolveResourceUsage(solve_count=1,
+                                        wall_time=time.perf_counter() - self._start_time,
+                                        child_cpu_time=child_cpu_time - self._start_rusage[0],
+                                        peak_rss_delta=max_rss - self._start_rusage[1],
+                                        temp_file_bytes=temp_file_bytes)
+        with GekkoContext._cumulative_usage_lock:
+            GekkoContext.cumulative_usage += self.usage
+
+    @classmethod
+    def reset_cumulative_usage(cls):
+        with cls._cumulative_usage_lock:
+            cls.cumulative_usage = SolveResourceUsage()
+
+    @staticmethod
+    def _get_rusage() -> Tuple[float, int]:
+        """
+        :return: The CPU time of all terminated child processes (e.g. the solver) & the peak RSS of this process.
+        """
+        if resource is None:  # Not available on Windows
+            return 0.0, 0
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return children.ru_utime + children.ru_stime, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    @staticmethod
+    def _read_telemetry(path: str) -> Optional[SolverTelemetry]:
+        """
+        :return: The telemetry from APOPT's log (also written without display), None if APOPT did not run.
+        """
+        try:
+            with open(os.path.join(path, 'APOPT.out'), 'r') as apopt_output:
+                telemetry = SolverTelemetry.from_apopt_output(apopt_output.read())
+        except OSError:
+            return None
+        try:
+            # The log's iteration times are rounded, use the solve time of the solver options if available.
+            with open(os.path.join(path, 'options.json'), 'r') as options_file:
+                telemetry.solve_time = float(json.load(options_file)['APM']['SOLVETIME'])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return telemetry
+
+    @staticmethod
+    def _get_directory_size(path: str) -> int:
+        size = 0
+        for directory, _, file_names in os.walk(path):
+            for file_name in file_names:
+                try:
+                    size += os.path.getsize(os.path.join(directory, file_name))
+                except OSError:
+                    pass
+        return size
+
+
+@dataclass
+class PresolvedTargets:
+    current_ratings: Optional[Dict[Union[Attributes, Skills], int]]  # Only if optimized on top of current ratings.
+    attribute_targets: Dict[Attributes, int]  # Folded attribute & trait targets
+    attribute_bounds: Dict[Attributes, IntBounds]
+    skill_bounds: Dict[Skills, IntBounds]
+    skill_targets: Dict[Skills, int]  # Only those not already met by the attribute targets.
+
+    @property
+    def is_closed_form_solvable(self) -> bool:
+        """
+        True, if each attribute has at most one skill target left.
+        """
+        related_attributes = [skill.value.related_attribute for skill in self.skill_targets]
+        return len(related_attributes) == len(set(related_attributes))
+
+    @property
+    def interchangeable_skill_groups(self) -> List[List[Skills]]:
+        """
+        Skills (in enum order), which can swap their ratings without changing cost or feasibility: Skills with equal
+        bounds and either without skill target (their related attribute does not matter then) or with the same related
+        attribute & skill target.
+        """
+        groups: Dict[Tuple, List[Skills]] = dict()
+        for skill, bounds in self.skill_bounds.items():
+            if skill in self.skill_targets:
+                key = (bounds.min, bounds.max, skill.value.related_attribute, self.skill_targets[skill])
+            else:
+                key = (bounds.min, bounds.max)
+            groups.setdefault(key, []).append(skill)
+        return [skills for skills in groups.values() if len(skills) > 1]
 
 
 class AttributeSkillOptimizer:
@@ -37,61 +265,297 @@ class AttributeSkillOptimizer:
     def __init__(self,
                  tier: int = 1,
                  is_verbose: bool = False,
-                 solver_options: Tuple[str] = DEFAULT_SOLVER_OPTIONS):
+                 solver_options: Tuple[str] = DEFAULT_SOLVER_OPTIONS,
+                 max_solve_time: Optional[float] = None,
+                 telemetry_trace_file: Optional[str] = None):
         if not Tier.is_valid_rating(tier):
             raise IOError(f"'tier' must be within {Tier.rating_bounds}, was {tier} instead.")
         self.tier: int = tier
         self.solver_id = 1  # Use APOPT to find the optimal Integer solution, since this is a MINLP.
         self.solver_options = solver_options
         self.is_verbose: bool = is_verbose
+        # [s], the solver is killed & the depth-first search is stopped (raising an exception) if they run longer.
+        self.max_solve_time: Optional[float] = max_solve_time
+        self.last_resource_usage: Optional[SolveResourceUsage] = None
+        self.last_solver_telemetry: Optional[SolverTelemetry] = None
+        self.last_solver_path: Optional[str] = None  # 'closed_form', 'minlp' or 'dfs_fallback' (after a failed MINLP)
+        self.telemetry_trace_file: Optional[str] = telemetry_trace_file  # JSON lines file, one record per selection.
 
-    def optimize_selection(self, target_values: Dict[str, int]) -> AttributeSkillOptimizerResults:
+    def optimize_selection(self,
+                           target_values: Dict[str, int],
+                           current_ratings: Optional[Dict[str, int]] = None) -> AttributeSkillOptimizerResults:
         """
-        Note
-        ----
-        This was done with the help of John Hedengren from Gekko (see https://stackoverflow.com/questions/65863807)
+        Presolves the targets & answers closed-form solvable selections directly, all others are solved as MINLP
+        (refined to the optimum by a depth-first search, which also takes over if APOPT fails). Interchangeable skills
+        are rated in canonical order.
+
+        :param target_values: A dictionary containing key-value pairs for the attributes, skills & traits.
+        :param current_ratings: Optional attribute & skill ratings the character already has. If given, they are the
+                                lower bounds of the ratings and only the additional XP & the purchases are returned.
+        """
+        self._validate_inputs(target_values, current_ratings)
+        self.last_resource_usage = None
+        self.last_solver_telemetry = None
+        self.last_solver_path = None
+        result = None
+        try:
+            presolved_targets = self.presolve(target_values, current_ratings)
+            if (ratings := self._solve_closed_form(presolved_targets)) is not None:
+                self.last_solver_path = 'closed_form'
+                attribute_ratings, skill_ratings = ratings
+            else:
+                self.last_solver_path = 'minlp'
+                # The MINLP, the depth-first search fallback & the descent share the max. solve time.
+                deadline = None if self.max_solve_time is None else time.monotonic() + self.max_solve_time
+                try:
+                    ratings = self._solve_minlp(presolved_targets)
+                except MinlpSolveError as solve_error:
+                    self.last_solver_path = 'dfs_fallback'
+                    # The depth-first search is exact, seed it with any selection within the max. cost.
+                    try:
+                        ratings = next(self._enumerate_ratings(presolved_targets,
+                                                               self._get_max_cost(presolved_targets),
+                                                               deadline),
+                                       None)
+                    except TimeoutError:
+                        raise solve_error
+                    if ratings is None:
+                        raise
+                attribute_ratings, skill_ratings = self._descend_to_optimal_ratings(presolved_targets, *ratings,
+                                                                                    deadline=deadline)
+
+            result = self._create_result(attribute_ratings,
+                                         self._canonicalize_skill_ratings(presolved_targets, skill_ratings),
+                                         target_values,
+                                         presolved_targets)
+            result.solver_telemetry = self.last_solver_telemetry
+            return result
+        finally:
+            if self.telemetry_trace_file is not None:
+                self._write_telemetry_trace(target_values, current_ratings, result)
+
+    def enumerate_optimal_selections(self,
+                                     target_values: Dict[str, int],
+                                     max_extra_xp: int = 0,
+                                     max_count: Optional[int] = None,
+                                     current_ratings: Optional[Dict[str, int]] = None
+                                     ) -> Iterator[AttributeSkillOptimizerResults]:
+        """
+        Lazily enumerates all distinct selections, which cost at most `max_extra_xp` more than the optimal selection,
+        e.g. to choose where to put the tree-of-learning skill ratings. Only the optimal cost is solved for, the
+        alternatives are enumerated by a depth-first search, which is pruned with that cost bound.
+
+        :param target_values: A dictionary containing key-value pairs for the attributes, skills & traits.
+        :param max_extra_xp: Allowed XP above the optimal cost.
+        :param max_count: Max. number of selections to return (all if None).
+        :param current_ratings: See `optimize_selection`.
+        """
+        self._validate_inputs(target_values, current_ratings)
+        presolved_targets = self.presolve(target_values, current_ratings)
+        max_cost = self._get_optimal_cost(presolved_targets,
+                                          self.optimize_selection(target_values, current_ratings)) + max_extra_xp
+        for attribute_ratings, skill_ratings in islice(self._enumerate_ratings(presolved_targets, max_cost), max_count):
+            yield self._create_result(attribute_ratings, skill_ratings, target_values, presolved_targets)
+
+    def count_optimal_selections(self,
+                                 target_values: Dict[str, int],
+                                 max_extra_xp: int = 0,
+                                 current_ratings: Optional[Dict[str, int]] = None) -> int:
+        """
+        :return: The number of selections `enumerate_optimal_selections` would return (without creating them).
+        """
+        self._validate_inputs(target_values, current_ratings)
+        presolved_targets = self.presolve(target_values, current_ratings)
+        max_cost = self._get_optimal_cost(presolved_targets,
+                                          self.optimize_selection(target_values, current_ratings)) + max_extra_xp
+        return sum(1 for _ in self._enumerate_ratings(presolved_targets, max_cost))
+
+    def _validate_inputs(self, target_values: Dict[str, int], current_ratings: Optional[Dict[str, int]]):
+        """
+        :raises IOError: If the target values or the current ratings are invalid.
         """
         if not is_valid_target_values_dict({Tier.full_name: self.tier, **target_values}):
             raise IOError(f"Invalid target values found: \n{json.dumps(target_values, indent=2)}")
+        if current_ratings is not None and not is_valid_current_ratings_dict(current_ratings):
+            raise IOError(f"Invalid current ratings found: \n{json.dumps(current_ratings, indent=2)}")
+
+    def presolve(self,
+                 target_values: Dict[str, int],
+                 current_ratings: Optional[Dict[str, int]] = None) -> PresolvedTargets:
+        """
+        Folds attribute & trait targets into one attribute lower bound each, drops the skill targets which are already
+        met by it & tightens the attribute and skill bounds with the remaining skill targets & the current ratings.
+        """
+        minimum_ratings = dict()
+        for name, rating in (current_ratings or dict()).items():
+            if (rating_enum := Attributes.get_by_name(name)) == Attributes.INVALID:
+                rating_enum = Skills.get_by_name(name)
+            minimum_ratings[rating_enum] = max(minimum_ratings.get(rating_enum, rating), rating)
 
-        with GekkoContext(remote=False) as solver:
-            # Define variables with optimized initial values.
-            attribute_ratings = [solver.Var(name=attribute.name,
-                                            value=target_values.get(attribute.name,
-                                                                    attribute.value.rating_bounds.min),
-                                            lb=attribute.value.rating_bounds.min,
-                                            ub=attribute.value.rating_bounds.max,
-                                            integer=True) for attribute in Attributes.get_valid_members()]
-            skill_ratings = [solver.Var(name=skill.name,
-                                        value=skill.value.rating_bounds.min,
-                                        lb=skill.value.rating_bounds.min,
-                                        ub=skill.value.rating_bounds.max,
-                                        integer=True) for skill in Skills.get_valid_members()]
-            # Optimize initial guess
-            for i, skill in enumerate(Skills):
-                if skill.name in target_values:
-                    attribute_rating = self._get_gekko_var(skill.value.related_attribute, attribute_ratings).value
-                    skill_ratings[i].value = target_values[skill.name] - attribute_rating
-
-            # Target value constraints: Target values must be met or larger.
-            for target, target_value in target_values.items():
-                if (target_enum := Attributes.get_by_name(target)) != Attributes.INVALID:
-                    solver.Equation(self._get_gekko_var(target_enum, attribute_ratings) >= target_value)
+        attribute_bounds = {attribute: IntBounds(minimum_ratings.get(attribute, attribute.value.rating_bounds.min),
+                                                 attribute.value.rating_bounds.max)
+                            for attribute in Attributes.get_valid_members()}
+        skill_bounds = {skill: IntBounds(minimum_ratings.get(skill, skill.value.rating_bounds.min),
+                                         skill.value.rating_bounds.max)
+                        for skill in Skills.get_valid_members()}
+        skill_targets: Dict[Skills, int] = dict()
+        for target, target_value in target_values.items():
+            if (target_enum := Attributes.get_by_name(target)) != Attributes.INVALID:
+                attribute_bounds[target_enum].min = max(attribute_bounds[target_enum].min, target_value)
+            elif (target_enum := Skills.get_by_name(target)) != Skills.INVALID:
+                skill_targets[target_enum] = max(skill_targets.get(target_enum, target_value), target_value)
+            else:  # Traits
+                target_enum = Traits.get_by_name(target)
+                attribute_bounds[target_enum.value.related_attribute].min = max(
+                    attribute_bounds[target_enum.value.related_attribute].min,
+                    target_value - target_enum.value.get_total_attribute_offset(related_tier=self.tier))
+
+        attribute_targets = {attribute: bounds.min for attribute, bounds in attribute_bounds.items()
+                             if bounds.min > attribute.value.rating_bounds.min}
+
+        # Skill targets beyond the max. skill (attribute) rating need a min. attribute (skill) rating.
+        for skill, target_value in skill_targets.items():
+            bounds = attribute_bounds[skill.value.related_attribute]
+            bounds.min = max(bounds.min, target_value - skill_bounds[skill].max)
+            skill_bounds[skill].min = max(skill_bounds[skill].min, target_value - bounds.max)
+            if bounds.min == bounds.max:
+                # Fixed attribute: Any higher skill rating costs more without helping the tree of learning.
+                skill_bounds[skill].max = skill_bounds[skill].min
+
+        return PresolvedTargets(current_ratings=None if current_ratings is None else {
+                                    rating_enum: minimum_ratings.get(rating_enum, rating_enum.value.rating_bounds.min)
+                                    for rating_enum in list(attribute_bounds) + list(skill_bounds)},
+                                attribute_targets=attribute_targets,
+                                attribute_bounds=attribute_bounds,
+                                skill_bounds=skill_bounds,
+                                skill_targets={skill: target_value for skill, target_value in skill_targets.items()
+                                               if target_value > attribute_targets.get(skill.value.related_attribute,
+                                                                                       0)})
+
+    @staticmethod
+    def _solve_closed_form(presolved_targets: PresolvedTargets) -> Optional[Tuple[Dict[str, int], Dict[str, int]]]:
+        """
+        Exhaustive search over the max. skill rating & a dynamic program over the attribute groups on the number of
+        non-zero skill ratings (tree of learning), which is exact if each attribute has at most one skill target.
+
+        :return: Attribute & skill ratings or None, if the targets are not closed-form solvable.
+        """
+        if not presolved_targets.is_closed_form_solvable:
+            return None
+
+        skill_target_by_attribute = {skill.value.related_attribute: (skill, target_value)
+                                     for skill, target_value in presolved_targets.skill_targets.items()}
+        untargeted_skill_ratings = {skill: bounds.min for skill, bounds in presolved_targets.skill_bounds.items()
+                                    if skill not in presolved_targets.skill_targets}
+        filler_cost = get_skill_xp_cost(1)
+
+        best_solution = None  # (total cost, attribute & skill rating choices, filler count)
+        for max_skill_rating in range(max(untargeted_skill_ratings.values()), Skill.rating_bounds.max + 1):
+            # Non-zero skill rating count -> (cost, (attribute, attribute rating, skill, skill rating) per group)
+            solutions = {sum(rating > 0 for rating in untargeted_skill_ratings.values()):
+                         (sum(map(get_skill_xp_cost, untargeted_skill_ratings.values())), ())}
+            for attribute, attribute_bounds in presolved_targets.attribute_bounds.items():
+                if attribute not in skill_target_by_attribute:
+                    # Without skill target, the cheapest attribute rating is its lower bound.
+                    options = [(get_attribute_xp_cost(attribute_bounds.min), attribute_bounds.min, None, 0)]
                 else:
-                    if (target_enum := Skills.get_by_name(target)) != Skills.INVALID:
-                        rating = self._get_gekko_var(target_enum, skill_ratings)
-                        related_attribute = target_enum.value.related_attribute
-                    else:  # Traits
-                        target_enum = Traits.get_by_name(target)
-                        rating = target_enum.value.get_total_attribute_offset(related_tier=self.tier)
-                        related_attribute = target_enum.value.related_attribute
-                    solver.Equation(rating + self._get_gekko_var(related_attribute, attribute_ratings) >= target_value)
+                    skill, target_value = skill_target_by_attribute[attribute]
+                    skill_bounds = presolved_targets.skill_bounds[skill]
+                    options = []
+                    for attribute_rating in attribute_bounds.as_range():
+                        skill_rating = max(skill_bounds.min, target_value - attribute_rating)
+                        if skill_rating <= min(skill_bounds.max, max_skill_rating):
+                            options.append((get_attribute_xp_cost(attribute_rating) + get_skill_xp_cost(skill_rating),
+                                            attribute_rating, skill, skill_rating))
+
+                next_solutions = dict()
+                for nonzero_count, (cost, choices) in solutions.items():
+                    for option_cost, attribute_rating, skill, skill_rating in options:
+                        next_nonzero_count = nonzero_count + (skill_rating > 0)
+                        next_cost = cost + option_cost
+                        if next_nonzero_count not in next_solutions or next_cost < next_solutions[next_nonzero_count][0]:
+                            next_solutions[next_nonzero_count] = (
+                                next_cost, choices + ((attribute, attribute_rating, skill, skill_rating),))
+                solutions = next_solutions
+
+            for nonzero_count, (cost, choices) in solutions.items():
+                filler_count = max(0, max_skill_rating - nonzero_count)
+                if best_solution is None or cost + filler_count * filler_cost < best_solution[0]:
+                    best_solution = (cost + filler_count * filler_cost, choices, filler_count)
+
+        if best_solution is None:
+            return None
+
+        _, choices, filler_count = best_solution
+        attribute_ratings = dict()
+        skill_ratings = {skill.name: rating for skill, rating in untargeted_skill_ratings.items()}
+        for attribute, attribute_rating, skill, skill_rating in choices:
+            attribute_ratings[attribute.name] = attribute_rating
+            if skill is not None:
+                skill_ratings[skill.name] = skill_rating
+        # Tree of learning: Fill up with the first skills without rating.
+        for skill_name in [name for name, rating in skill_ratings.items() if rating == 0][:filler_count]:
+            skill_ratings[skill_name] = 1
+        return ({attribute.name: attribute_ratings[attribute.name] for attribute in Attributes.get_valid_members()},
+                {skill.name: skill_ratings[skill.name] for skill in Skills.get_valid_members()})
+
+    def _solve_minlp(self, presolved_targets: PresolvedTargets) -> Tuple[Dict[str, int], Dict[str, int]]:
+        gekko_context = GekkoContext(remote=False, max_time=self.max_solve_time)
+        try:
+            return self._build_and_solve_minlp(gekko_context, presolved_targets)
+        finally:
+            # Also on failed solves (e.g. 'Solution Not Found'), to see where APOPT got stuck.
+            self.last_resource_usage = gekko_context.usage
+            self.last_solver_telemetry = gekko_context.telemetry
+
+    def _build_and_solve_minlp(self,
+                               gekko_context: GekkoContext,
+                               presolved_targets: PresolvedTargets) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """
+        Note
+        ----
+        This was done with the help of John Hedengren from Gekko (see https://stackoverflow.com/questions/65863807)
+        """
+        with gekko_context as solver:
+            # Only the presolved remainder is solved: The presolved bounds (implied by the targets & current ratings)
+            # are the variable bounds, which fixes the variables forced to one rating. The initial attribute ratings
+            # are their lower bounds (incl. the folded attribute & trait targets).
+            attribute_ratings = [self._create_gekko_var(solver, attribute, bounds, value=bounds.min)
+                                 for attribute, bounds in presolved_targets.attribute_bounds.items()]
+            # Symmetry reduction: Skills without (remaining) target only count for the tree of learning, so they stay
+            # at their lower bound or get rating 1 as filler. The filler skills are interchangeable, only their number
+            # is a variable & the filler is assigned canonically after the solve.
+            targeted_skills = [skill for skill in Skills.get_valid_members()
+                               if skill in presolved_targets.skill_targets]
+            fixed_skill_ratings = {skill: bounds.min for skill, bounds in presolved_targets.skill_bounds.items()
+                                   if skill not in presolved_targets.skill_targets and bounds.min > 0}
+            filler_skills = [skill for skill, bounds in presolved_targets.skill_bounds.items()
+                             if skill not in presolved_targets.skill_targets and bounds.min == 0]
+            skill_ratings = []
+            for skill in targeted_skills:
+                # Optimized initial guess
+                bounds = presolved_targets.skill_bounds[skill]
+                initial_skill_rating = presolved_targets.skill_targets[skill] \
+                    - self._get_gekko_var(skill.value.related_attribute, attribute_ratings).value
+                if presolved_targets.current_ratings is not None:
+                    # Only clamp on top of current ratings, the unclamped guess steers APOPT to better optima.
+                    initial_skill_rating = max(initial_skill_rating, bounds.min)
+                skill_ratings.append(self._create_gekko_var(solver, skill, bounds, value=initial_skill_rating))
+            filler_count = solver.Var(name='filler_count', value=0, lb=0, ub=len(filler_skills), integer=True)
+
+            # Target value constraints: The remaining skill targets must be met or larger (the attribute & trait targets
+            # & the dominated skill targets are met by the attribute bounds).
+            for skill, target_value in presolved_targets.skill_targets.items():
+                solver.Equation(self._get_gekko_var(skill, skill_ratings)
+                                + self._get_gekko_var(skill.value.related_attribute, attribute_ratings) >= target_value)
 
             # Tree of learning constraint: number of non-zero skill ratings >= max. skill rating
             epsilon_for_zero = 0.5  # threshold for a "zero" value
             number_of_nonzero_skill_ratings = solver.sum(
-                [solver.if3(skill_rating - epsilon_for_zero, 0, 1) for skill_rating in skill_ratings])
-            max_skill_rating = 0
+                [solver.if3(skill_rating - epsilon_for_zero, 0, 1) for skill_rating in skill_ratings]) \
+                + filler_count + len(fixed_skill_ratings)
+            # The filler rating 1 is always covered by the tree of learning & does not need to be in the max.
+            max_skill_rating = max(fixed_skill_ratings.values(), default=0)
             for skill_rating in skill_ratings:
                 max_skill_rating = solver.Intermediate(solver.max3(max_skill_rating, skill_rating))
             solver.Equation(number_of_nonzero_skill_ratings >= max_skill_rating)
@@ -101,7 +565,9 @@ class AttributeSkillOptimizer:
             attribute_cost = solver.Intermediate(
                 solver.sum((k - 1) * (k + 2) + 2.5 * (attribute_ratings - k) * (attribute_ratings + k - 3)),
                 name='attribute_cost')
-            skill_cost = solver.Intermediate(solver.sum(skill_ratings * (np.array(skill_ratings) + 1)),
+            skill_cost = solver.Intermediate(solver.sum(skill_ratings * (np.array(skill_ratings) + 1))
+                                             + get_skill_xp_cost(1) * filler_count
+                                             + sum(map(get_skill_xp_cost, fixed_skill_ratings.values())),
                                              name='skill_cost')
             solver.Obj(attribute_cost + skill_cost)
 
@@ -109,32 +575,256 @@ class AttributeSkillOptimizer:
             solver.options.SOLVER = self.solver_id
             solver.solver_options = self.solver_options
 
-            solver.solve(disp=self.is_verbose)
-
-            result = AttributeSkillOptimizerResults()
-            result.Tier = self.tier
-            result.Attributes = self._get_property_result(Attributes, attribute_ratings + skill_ratings, target_values)
-            skill_property_results = self._get_property_result(Skills, attribute_ratings + skill_ratings, target_values)
-            result.Skills = SkillResults(
-                rating_values={skill.name: int(self._get_gekko_var(skill, skill_ratings).value[0])
-                               for skill in Skills.get_valid_members()},
-                total_values=skill_property_results.Total,
-                target_values=skill_property_results.Target)
-            result.Traits = self._get_property_result(Traits,
-                                                      attribute_ratings + skill_ratings,
-                                                      target_values)
-            result.XPCost = XPCost(attribute_costs=int(attribute_cost.VALUE.value[0]),
-                                   skill_costs=int(skill_cost.VALUE.value[0]),
-                                   total_costs=int(solver.options.objfcnval))
-            return result
+            try:
+                solver.solve(disp=self.is_verbose)
+            except Exception as error:  # GEKKO raises plain exceptions, e.g. '@error: Solution Not Found'
+                raise MinlpSolveError(str(error).strip()) from error
+
+            # Cross-check of the objective & the costs from the ratings (raises on mismatch).
+            XPCost(attribute_costs=int(attribute_cost.VALUE.value[0]),
+                   skill_costs=int(skill_cost.VALUE.value[0]),
+                   total_costs=int(solver.options.objfcnval))
+            attribute_ratings = {attribute.name: int(self._get_gekko_var(attribute, attribute_ratings).value[0])
+                                 for attribute in Attributes.get_valid_members()}
+            targeted_skill_ratings = {skill.name: int(skill_rating.value[0])
+                                      for skill, skill_rating in zip(targeted_skills, skill_ratings)}
+            skill_ratings = {skill.name: fixed_skill_ratings.get(skill, 0) for skill in Skills.get_valid_members()}
+            skill_ratings.update(targeted_skill_ratings)
+            skill_ratings.update({skill.name: 1 for skill in filler_skills[:int(filler_count.value[0])]})
+
+        return attribute_ratings, skill_ratings
+
+    def _get_optimal_cost(self, presolved_targets: PresolvedTargets, result: AttributeSkillOptimizerResults) -> int:
+        """
+        :return: The full cost (incl. current ratings) of the (optimal) result.
+        """
+        current_ratings = {rating_enum.name: rating for rating_enum, rating in
+                           (presolved_targets.current_ratings or dict()).items()}
+        return result.XPCost.Total + self._get_xp_cost(current_ratings).Total
+
+    @staticmethod
+    def _get_max_cost(presolved_targets: PresolvedTargets) -> int:
+        """
+        :return: The cost of all attribute & skill ratings at their upper bound (bounds all feasible selections).
+        """
+        return sum(get_attribute_xp_cost(bounds.max) for bounds in presolved_targets.attribute_bounds.values()) \
+            + sum(get_skill_xp_cost(bounds.max) for bounds in presolved_targets.skill_bounds.values())
+
+    def _descend_to_optimal_ratings(self,
+                                    presolved_targets: PresolvedTargets,
+                                    attribute_ratings: Dict[str, int],
+                                    skill_ratings: Dict[str, int],
+                                    deadline: Optional[float] = None) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """
+        The MINLP may stop at a local optimum: Repeatedly searches for cheaper ratings with the depth-first search,
+        which is pruned well by the cost bound of the found ratings.
+
+        :param deadline: `time.monotonic()` after which the search raises a TimeoutError (None: no limit).
+        :return: The cheapest attribute & skill ratings.
+        """
+        ratings = (attribute_ratings, skill_ratings)
+        while (cheaper_ratings := next(self._enumerate_ratings(
+                presolved_targets, self._get_xp_cost({**ratings[0], **ratings[1]}).Total - 1, deadline),
+                None)) is not None:
+            ratings = cheaper_ratings
+        return ratings
+
+    def _write_telemetry_trace(self,
+                               target_values: Dict[str, int],
+                               current_ratings: Optional[Dict[str, int]],
+                               result: Optional[AttributeSkillOptimizerResults]):
+        """
+        Appends one JSON line per selection (also failed ones) to the telemetry trace file. Write errors are only
+        logged, so the trace never changes the result of the selection.
+        """
+        telemetry = self.last_solver_telemetry
+        record = {'time': time.time(),
+                  'tier': self.tier,
+                  'target_values': target_values,
+                  'current_ratings': current_ratings,
+                  'solver': self.last_solver_path,
+                  'xp_cost': None if result is None else result.XPCost.Total,
+                  'reached_limits': [] if telemetry is None else telemetry.reached_limits(self.solver_options),
+                  'telemetry': None if telemetry is None else {**asdict(telemetry),
+                                                               'is_successful': telemetry.is_successful},
+                  'resource_usage': None if self.last_resource_usage is None else asdict(self.last_resource_usage)}
+        try:
+            with TELEMETRY_TRACE_LOCK, open(self.telemetry_trace_file, 'a') as trace_file:
+                trace_file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        except OSError as error:
+            logger.warning(f"Telemetry trace could not be written to '{self.telemetry_trace_file}': {error}")
+
+    @staticmethod
+    def _canonicalize_skill_ratings(presolved_targets: PresolvedTargets,
+                                    skill_ratings: Dict[str, int]) -> Dict[str, int]:
+        """
+        :return: The skill ratings, with the ratings of interchangeable skills (e.g. the tree-of-learning filler) sorted
+                 descending in enum order, so symmetric selections have one canonical representation.
+        """
+        canonical_skill_ratings = dict(skill_ratings)
+        for skills in presolved_targets.interchangeable_skill_groups:
+            ratings = sorted((skill_ratings[skill.name] for skill in skills), reverse=True)
+            canonical_skill_ratings.update({skill.name: rating for skill, rating in zip(skills, ratings)})
+        return canonical_skill_ratings
+
+    @staticmethod
+    def _enumerate_ratings(presolved_targets: PresolvedTargets,
+                           max_cost: int,
+                           deadline: Optional[float] = None) -> Iterator[Tuple[Dict[str, int], Dict[str, int]]]:
+        """
+        Depth-first search over all attribute, then all skill ratings, which meet the targets & the tree of learning
+        within the max. cost. Branches are pruned by the min. cost of the remaining ratings.
+
+        :param deadline: `time.monotonic()` after which the search raises a TimeoutError (None: no limit).
+        :return: Attribute & skill ratings of each found selection.
+        """
+        attributes = list(presolved_targets.attribute_bounds)
+        skills = list(presolved_targets.skill_bounds)
+        skills_by_attribute = {attribute: [skill for skill in skills if skill.value.related_attribute == attribute]
+                               for attribute in attributes}
+
+        def get_min_skill_rating(skill: Skills, attribute_rating: int) -> int:
+            return max(presolved_targets.skill_bounds[skill].min,
+                       presolved_targets.skill_targets.get(skill, 0) - attribute_rating)
+
+        def get_min_group_cost(attribute: Attributes, attribute_rating: int) -> Optional[int]:
+            min_skill_ratings = [get_min_skill_rating(skill, attribute_rating) for skill in skills_by_attribute[attribute]]
+            if any(rating > skill.value.rating_bounds.max
+                   for skill, rating in zip(skills_by_attribute[attribute], min_skill_ratings)):
+                return None
+            return get_attribute_xp_cost(attribute_rating) + sum(map(get_skill_xp_cost, min_skill_ratings))
+
+        # Min. cost of the attribute groups i..n (attribute & related skills)
+        remaining_group_costs = [0] * (len(attributes) + 1)
+        for i in reversed(range(len(attributes))):
+            group_costs = [cost for rating in presolved_targets.attribute_bounds[attributes[i]].as_range()
+                           if (cost := get_min_group_cost(attributes[i], rating)) is not None]
+            if not group_costs:
+                return
+            remaining_group_costs[i] = remaining_group_costs[i + 1] + min(group_costs)
+
+        def check_deadline():
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError("The depth-first search exceeded the max. solve time.")
+
+        filler_cost = get_skill_xp_cost(1)
+        attribute_ratings: Dict[str, int] = dict()
+        skill_ratings: Dict[str, int] = dict()
+
+        def enumerate_skill_ratings(i: int, cost: int, min_skill_ratings: List[int], remaining_skill_costs: List[int],
+                                    remaining_forced_nonzero_counts: List[int], nonzero_count: int, max_rating: int):
+            check_deadline()
+            if i == len(skills):
+                if nonzero_count >= max_rating:
+                    yield dict(attribute_ratings), dict(skill_ratings)
+                return
+            skill = skills[i]
+            for rating in range(min_skill_ratings[i], skill.value.rating_bounds.max + 1):
+                next_cost = cost + get_skill_xp_cost(rating)
+                next_nonzero_count = nonzero_count + (rating > 0)
+                next_max_rating = max(max_rating, rating)
+                # Additional non-zero ratings, which are needed for the tree of learning, cost at least 2 XP each.
+                missing_nonzero_count = max(0, next_max_rating - next_nonzero_count
+                                            - remaining_forced_nonzero_counts[i + 1])
+                available_nonzero_count = len(skills) - i - 1 - remaining_forced_nonzero_counts[i + 1]
+                if next_cost + remaining_skill_costs[i + 1] + missing_nonzero_count * filler_cost > max_cost:
+                    break  # Higher ratings only cost more.
+                if missing_nonzero_count > available_nonzero_count:
+                    if rating == 0:
+                        continue  # A non-zero rating might still meet the tree of learning.
+                    break
+                skill_ratings[skill.name] = rating
+                yield from enumerate_skill_ratings(i + 1, next_cost, min_skill_ratings, remaining_skill_costs,
+                                                   remaining_forced_nonzero_counts, next_nonzero_count,
+                                                   next_max_rating)
+            skill_ratings.pop(skill.name, None)
+
+        def enumerate_attribute_ratings(i: int, cost: int, min_group_costs: int):
+            check_deadline()
+            if i == len(attributes):
+                min_skill_ratings = [get_min_skill_rating(skill,
+                                                          attribute_ratings[skill.value.related_attribute.name])
+                                     for skill in skills]
+                remaining_skill_costs = [0] * (len(skills) + 1)
+                remaining_forced_nonzero_counts = [0] * (len(skills) + 1)
+                for j in reversed(range(len(skills))):
+                    remaining_skill_costs[j] = remaining_skill_costs[j + 1] + get_skill_xp_cost(min_skill_ratings[j])
+                    remaining_forced_nonzero_counts[j] = remaining_forced_nonzero_counts[j + 1] \
+                        + (min_skill_ratings[j] > 0)
+                yield from enumerate_skill_ratings(0, cost, min_skill_ratings, remaining_skill_costs,
+                                                   remaining_forced_nonzero_counts, 0, 0)
+                return
+            attribute = attributes[i]
+            for rating in presolved_targets.attribute_bounds[attribute].as_range():
+                group_cost = get_min_group_cost(attribute, rating)
+                if group_cost is None:
+                    continue
+                if min_group_costs + group_cost + remaining_group_costs[i + 1] > max_cost:
+                    continue  # Not monotonic: Higher attribute ratings may lower the skill costs.
+                attribute_ratings[attribute.name] = rating
+                yield from enumerate_attribute_ratings(i + 1, cost + get_attribute_xp_cost(rating),
+                                                       min_group_costs + group_cost)
+            attribute_ratings.pop(attribute.name, None)
+
+        yield from enumerate_attribute_ratings(0, 0, 0)
+
+    @staticmethod
+    def _create_gekko_var(solver: GEKKO,
+                          attribute_or_skill: Union[Attributes, Skills],
+                          bounds: IntBounds,
+                          value: int) -> GEKKO.Var:
+        """
+        :return: An integer variable within the bounds (fixed if they allow only one rating).
+        """
+        return solver.Var(name=attribute_or_skill.name, value=value, lb=bounds.min, ub=bounds.max, integer=True)
 
     @staticmethod
     def _get_gekko_var(attribute_or_skill: Union[Attributes, Skills], ratings: List[GEKKO.Var]) -> Optional[GEKKO.Var]:
         return next((rating for rating in ratings if rating.name == f"int_{attribute_or_skill.name.lower()}"), None)
 
+    @staticmethod
+    def _get_xp_cost(ratings: Dict[str, int]) -> XPCost:
+        """
+        :param ratings: Attribute & skill ratings by name; missing ones are at their min. rating.
+        """
+        return XPCost(attribute_costs=sum(get_attribute_xp_cost(rating) for name, rating in ratings.items()
+                                          if name in Attributes.__members__),
+                      skill_costs=sum(get_skill_xp_cost(rating) for name, rating in ratings.items()
+                                      if name not in Attributes.__members__))
+
+    def _create_result(self,
+                       attribute_ratings: Dict[str, int],
+                       skill_ratings: Dict[str, int],
+                       target_values: Dict[str, int],
+                       presolved_targets: PresolvedTargets) -> AttributeSkillOptimizerResults:
+        all_ratings = {**attribute_ratings, **skill_ratings}
+        xp_cost = self._get_xp_cost(all_ratings)
+        result = AttributeSkillOptimizerResults()
+        result.Tier = self.tier
+        result.Attributes = self._get_property_result(Attributes, all_ratings, target_values)
+        skill_property_results = self._get_property_result(Skills, all_ratings, target_values)
+        result.Skills = SkillResults(rating_values=dict(skill_ratings),
+                                     total_values=skill_property_results.Total,
+                                     target_values=skill_property_results.Target)
+        result.Traits = self._get_property_result(Traits, all_ratings, target_values)
+        result.XPCost = xp_cost
+        if presolved_targets.current_ratings is not None:
+            current_ratings = {rating_enum.name: rating for rating_enum, rating in
+                               presolved_targets.current_ratings.items()}
+            current_xp_cost = self._get_xp_cost(current_ratings)
+            result.XPCost = XPCost(attribute_costs=xp_cost.Attributes - current_xp_cost.Attributes,
+                                   skill_costs=xp_cost.Skills - current_xp_cost.Skills)
+            purchased_names = [name for name, rating in all_ratings.items() if rating > current_ratings[name]]
+            result.Purchases = PurchaseResults(
+                current_values={name: current_ratings[name] for name in purchased_names},
+                new_values={name: all_ratings[name] for name in purchased_names},
+                xp_costs={name: self._get_xp_cost({name: all_ratings[name]}).Total
+                          - self._get_xp_cost({name: current_ratings[name]}).Total for name in purchased_names})
+        return result
+
     def _get_property_result(self,
                              property_class: Union[Type[Attributes], Type[Skills], Type[Traits]],
-                             all_ratings: List[GEKKO.Var],
+                             all_ratings: Dict[str, int],
                              target_values: Dict[str, int]) -> CharacterPropertyResults:
 
         property_result = CharacterPropertyResults()
@@ -143,35 +833,109 @@ class AttributeSkillOptimizer:
             property_result.Total[property_name] = self._get_total_value(property_member, all_ratings)
             if property_name in target_values:
                 property_result.Target[property_name] = target_values[property_name]
-                if property_result.Target[property_name] != property_result.Total[property_name]:
-                    property_result.Missed.append(property_name)
         return property_result
 
-    def _get_total_value(self, target_enum: Union[Attributes, Skills, Traits], all_ratings: List[GEKKO.Var]) -> int:
+    def _get_total_value(self, target_enum: Union[Attributes, Skills, Traits], all_ratings: Dict[str, int]) -> int:
         if target_enum in Attributes:
             rating = 0
             related_attribute = target_enum
         elif target_enum in Skills:
-            rating = int(self._get_gekko_var(target_enum, all_ratings).value[0])
+            rating = all_ratings[target_enum.name]
             related_attribute = target_enum.value.related_attribute
         else:  # Traits
             rating = target_enum.value.get_total_attribute_offset(self.tier)
             related_attribute = target_enum.value.related_attribute
 
-        return rating + int(self._get_gekko_var(related_attribute, all_ratings).value[0])
+        return rating + all_ratings[related_attribute.name]
+
+
+def get_attribute_xp_cost(rating: int) -> int:
+    """
+    :return: The cumulative XP cost of an attribute rating (see README for the derivation).
+    """
+    k = min(rating, 3)
+    return (k - 1) * (k + 2) + 5 * (rating - k) * (rating + k - 3) // 2
+
+
+def get_skill_xp_cost(rating: int) -> int:
+    """
+    :return: The cumulative XP cost of a skill rating (see README for the derivation).
+    """
+    return rating * (rating + 1)
 
 
-def optimize_xp(target_values: Dict[str, int], is_verbose: bool = False) -> AttributeSkillOptimizerResults:
+def optimize_xp(target_values: Dict[str, int],
+                is_verbose: bool = False,
+                max_solve_time: Optional[float] = None,
+                current_ratings: Optional[Dict[str, int]] = None,
+                telemetry_trace_file: Optional[str] = None) -> AttributeSkillOptimizerResults:
     """
     :param target_values: A dictionary containing key-value pairs for 'Tier' and the attributes, skills & traits.
     :param is_verbose: Flag to show detailed solver output.
+    :param max_solve_time: Time limit [s] for the solver & the depth-first search, the solve raises an exception if
+                           it is exceeded.
+    :param current_ratings: Optional attribute & skill ratings of the character, only additional XP is optimized.
+    :param telemetry_trace_file: Optional JSON lines file, to which the solver telemetry of the selection is appended.
     :return: The attributes, skills & traits. Either as Markdown table or as JSON string.
     """
     tier = target_values.pop('Tier', None)
     if tier is None:
         raise IOError("'Tier' is a mandatory parameter!")
-    optimizer = AttributeSkillOptimizer(tier=tier, is_verbose=is_verbose)
-    return optimizer.optimize_selection(target_values=target_values)
+    optimizer = AttributeSkillOptimizer(tier=tier,
+                                        is_verbose=is_verbose,
+                                        max_solve_time=max_solve_time,
+                                        telemetry_trace_file=telemetry_trace_file)
+    return optimizer.optimize_selection(target_values=target_values, current_ratings=current_ratings)
+
+
+def export_optimized_xp(target_values_list: Iterable[Dict[str, int]],
+                        stream: TextIO,
+                        output_format: str = 'md',
+                        max_solve_time: Optional[float] = None) -> int:
+    """
+    Optimizes the target values one after the other & streams each result into the stream, e.g. for bulk exports.
+
+    :param target_values_list: Target values dicts, each incl. 'Tier'.
+    :param output_format: One of `RESULT_WRITERS` ('md', 'json' for JSON lines or 'csv').
+    :return: The number of written results.
+    """
+    if output_format not in RESULT_WRITERS:
+        raise IOError(f"'output_format' must be one of {list(RESULT_WRITERS)}, was '{output_format}' instead.")
+    writer = RESULT_WRITERS[output_format](stream)
+    for target_values in target_values_list:
+        writer.write(optimize_xp(dict(target_values), max_solve_time=max_solve_time))
+    return writer.result_count
+
+
+# Compact positional layout for bulk clients: One integer per name, in enum order. In target vectors, 0 means no target
+# (which is met by any rating anyway).
+TARGET_VECTOR_NAMES: Tuple[str, ...] = (Tier.full_name,) + tuple(
+    member.name for property_class in [Attributes, Skills, Traits] for member in property_class.get_valid_members())
+CURRENT_RATINGS_VECTOR_NAMES: Tuple[str, ...] = tuple(
+    member.name for property_class in [Attributes, Skills] for member in property_class.get_valid_members())
+
+
+def get_target_values_from_vector(target_vector: Sequence[int]) -> Dict[str, int]:
+    """
+    :param target_vector: The tier & the attribute, skill (total) & trait targets in `TARGET_VECTOR_NAMES` order.
+    :return: The target values dict (incl. tier), without the entries without target.
+    :raises IOError: If the vector has the wrong length.
+    """
+    if len(target_vector) != len(TARGET_VECTOR_NAMES):
+        raise IOError(f"Target vectors must have {len(TARGET_VECTOR_NAMES)} entries, got {len(target_vector)}.")
+    return {name: value for name, value in zip(TARGET_VECTOR_NAMES, target_vector)
+            if value != 0 or name == Tier.full_name}
+
+
+def get_current_ratings_from_vector(current_ratings_vector: Sequence[int]) -> Dict[str, int]:
+    """
+    :param current_ratings_vector: The attribute & skill ratings in `CURRENT_RATINGS_VECTOR_NAMES` order.
+    :raises IOError: If the vector has the wrong length.
+    """
+    if len(current_ratings_vector) != len(CURRENT_RATINGS_VECTOR_NAMES):
+        raise IOError(f"Current ratings vectors must have {len(CURRENT_RATINGS_VECTOR_NAMES)} entries, got "
+                      f"{len(current_ratings_vector)}.")
+    return dict(zip(CURRENT_RATINGS_VECTOR_NAMES, current_ratings_vector))
 
 
 def is_valid_target_values_dict(target_values: Dict[str, int]) -> bool:
@@ -188,6 +952,33 @@ def is_valid_target_values_dict(target_values: Dict[str, int]) -> bool:
     return True
 
 
+def get_canonical_names(values: Dict[str, int]) -> Dict[str, int]:
+    """
+    Renames full & short names of the tier, attributes, skills & traits to their enum names (e.g. 'Ballistic Skill' ->
+    'BallisticSkill'), so equivalent inputs are equal. Unknown names & names, whose enum name is given too, are kept.
+    """
+    canonical_values = dict()
+    for name, value in values.items():
+        canonical_name = name
+        for property_class in [Attributes, Skills, Traits]:
+            if (property_member := property_class.get_by_name(name)) != property_class.INVALID:
+                canonical_name = property_member.name
+                break
+        if canonical_name in values or canonical_name in canonical_values:
+            canonical_name = name
+        canonical_values[canonical_name] = value
+    return canonical_values
+
+
+def is_valid_current_ratings_dict(current_ratings: Dict[str, int]) -> bool:
+    """
+    Current ratings are attribute & skill ratings (not skill totals).
+    """
+    return all(Attributes.get_by_name(name).value.is_valid_rating(rating)
+               or Skills.get_by_name(name).value.is_valid_rating(rating)
+               for name, rating in current_ratings.items())
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description=f"XP Optimizer for Wrath & Glory v{AttributeSkillOptimizer.WRATH_AND_GLORY_CORE_RULES_VERSION}. "
@@ -200,6 +991,23 @@ if __name__ == '__main__':
                         help='A json file with the name-value pairs for the target values (see other input arguments '
                              'for names & value ranges). The file MUST contain the tier value. If the file is '
                              'specified, duplicate command line parameters take precedence.')
+    parser.add_argument('-c', '--current_ratings_file',
+                        type=str,
+                        help='A json file with the name-value pairs for the current attribute & skill ratings (not '
+                             'totals) of the character. If specified, only the additional XP & the purchases are '
+                             'optimized.')
+    parser.add_argument('-t', '--telemetry_trace_file',
+                        type=str,
+                        help='A json lines file, to which the solver telemetry (APOPT iterations, nodes, gap, status, '
+                             '...) is appended.')
+    parser.add_argument('-b', '--bulk_file',
+                        type=str,
+                        help='A json lines file with one target values object (incl. the tier) per line. If specified, '
+                             'all of them are optimized & the results are written in the --output_format.')
+    parser.add_argument('-o', '--output_format',
+                        choices=list(RESULT_WRITERS),
+                        default='md',
+                        help='Output format of the --bulk_file results: Markdown tables, json lines or csv.')
     parser.add_argument('-j', '--return_json',
                         action='store_true',
                         help='If enabled, prints the result as JSON string instead of as Markdown table (default).')
@@ -222,6 +1030,15 @@ if __name__ == '__main__':
 
     input_arguments = vars(parser.parse_args())
 
+    if input_arguments['bulk_file'] is not None:
+        if not os.path.isfile(input_arguments['bulk_file']):
+            raise FileNotFoundError(f"For argument '--bulk_file {input_arguments['bulk_file']}'")
+        with open(input_arguments['bulk_file'], 'r') as file:
+            export_optimized_xp((json.loads(line) for line in file if line.strip()),
+                                sys.stdout,
+                                output_format=input_arguments['output_format'])
+        sys.exit(0)
+
     # Input values from file...
     input_target_values = dict()
     if input_arguments['file'] is not None:
@@ -237,5 +1054,16 @@ if __name__ == '__main__':
     if input_arguments['Tier'] is not None:
         input_target_values['Tier'] = input_arguments['Tier']
 
-    optimizer_result = optimize_xp(input_target_values, is_verbose=input_arguments['verbose'])
-    print(json.dumps(dict(optimizer_result), indent=2) if input_arguments['return_json'] else str(optimizer_result))
+    input_current_ratings = None
+    if input_arguments['current_ratings_file'] is not None:
+        if not os.path.isfile(input_arguments['current_ratings_file']):
+            raise FileNotFoundError(f"For argument '--current_ratings_file {input_arguments['current_ratings_file']}'")
+        with open(input_arguments['current_ratings_file'], 'r') as file:
+            input_current_ratings = json.load(file)
+
+    optimizer_result = optimize_xp(input_target_values,
+                                   is_verbose=input_arguments['verbose'],
+                                   current_ratings=input_current_ratings,
+                                   telemetry_trace_file=input_arguments['telemetry_trace_file'])
+    compact_result = CompactResults.from_results(optimizer_result)
+    print(compact_result.to_json(indent=2) if input_arguments['return_json'] else compact_result.to_markdown())
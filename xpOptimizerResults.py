@@ -1,4 +1,10 @@
-from typing import Dict, List, Optional
+from __future__ import annotations
+
+import csv
+import json
+from abc import ABC, abstractmethod
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple, Iterator, Iterable, TextIO, Union, Any
 
 
 class CharacterPropertyResults:
@@ -17,39 +23,7 @@ class CharacterPropertyResults:
         """
         Creates a markdown-table string representation of the object.
         """
-        name_width = max(len('Name'), max(len(name) for name in self.Total))
-        max_value_header_width = max(len(header_name) for header_name, _ in self)
-        value_width = max(max_value_header_width, max(len(str(value)) for value in self.Total.values()))
-
-        name_format = "{0:" + str(name_width) + "}"
-        value_format = "{0:<" + str(value_width) + "}"
-
-        # Table header
-        as_string = name_format.format('Name')
-        for column_name, _ in self:
-            as_string += ' | ' + value_format.format(column_name)
-
-        # Header separator
-        as_string += '\n' + '-' * name_width
-        for _, _ in self:
-            as_string += ' | ' + '-' * value_width
-
-        # Table rows
-        for row_name in self.Total:
-            as_string += '\n' + name_format.format(row_name)
-            for column_name, column_data in self:
-                as_string += ' | '
-                row_data = '-'
-                if column_name == 'Missed':
-                    if row_name in self.Missed:
-                        row_data = 'YES'
-                    elif row_name in self.Target:
-                        row_data = 'NO'
-                elif row_name in column_data:
-                    row_data = column_data[row_name]
-                as_string += value_format.format(row_data)
-
-        return as_string
+        return PropertyTable.from_results(self).to_markdown()
 
     def __repr__(self):
         return str(dict(self))
@@ -101,24 +75,37 @@ class XPCost:
         """
         Creates a markdown-table string representation of the object.
         """
-        name_width = max(len('Name'), max(len(name) for name, _ in self))
-        value_width = max(len('Cost'), max(len(str(value)) for _, value in self))
+        return format_markdown_table(('Cost',), [(name, (value,)) for name, value in self])
 
-        def format_row(name: str, data, prefix: str = '\n') -> str:
-            return prefix + ("{0:" + str(name_width) + "}").format(name) + ' | ' + (
-                    "{0:<" + str(value_width) + "}").format(data)
+    def __repr__(self):
+        return str(dict(self))
 
-        # Table header + separator
-        as_string = format_row('Name', 'Cost', prefix='')
 
-        # Header separator
-        as_string += format_row('-' * name_width, '-' * value_width)
+class PurchaseResults:
+    """
+    The attribute & skill ratings to buy on top of the current ratings of a character, with their XP cost.
+    """
 
-        # Table rows
-        for row_name, row_data in self:
-            as_string += format_row(row_name, row_data)
+    def __init__(self,
+                 current_values: Dict[str, int] = None,
+                 new_values: Dict[str, int] = None,
+                 xp_costs: Dict[str, int] = None):
+        self.Current: Dict[str, int] = current_values if current_values is not None else dict()
+        self.New: Dict[str, int] = new_values if new_values is not None else dict()
+        self.XPCost: Dict[str, int] = xp_costs if xp_costs is not None else dict()
 
-        return as_string
+    def __iter__(self) -> dict:
+        yield 'Current', self.Current
+        yield 'New', self.New
+        yield 'XPCost', self.XPCost
+
+    def __str__(self):
+        """
+        Creates a markdown-table string representation of the object.
+        """
+        return format_markdown_table(('Current', 'New', 'XPCost'),
+                                     [(name, (self.Current[name], self.New[name], self.XPCost[name]))
+                                      for name in self.New])
 
     def __repr__(self):
         return str(dict(self))
@@ -130,26 +117,267 @@ class AttributeSkillOptimizerResults:
                  attributes: CharacterPropertyResults = CharacterPropertyResults(),
                  skills: SkillResults = SkillResults(),
                  traits: CharacterPropertyResults = CharacterPropertyResults(),
-                 xp_cost: XPCost = XPCost()
+                 xp_cost: XPCost = XPCost(),
+                 purchases: Optional[PurchaseResults] = None
                  ):
         self.Tier: Optional[int] = tier
         self.Attributes: CharacterPropertyResults = attributes
         self.Skills: SkillResults = skills
         self.Traits: CharacterPropertyResults = traits
-        self.XPCost: XPCost = xp_cost
+        self.XPCost: XPCost = xp_cost  # Only the additional XP, if optimized on top of current ratings.
+        self.Purchases: Optional[PurchaseResults] = purchases  # Only if optimized on top of current ratings.
+        # Solve metadata (not part of the result sections): xpOptimizer.SolverTelemetry of the MINLP solve, if any.
+        self.solver_telemetry = None
 
     def __iter__(self) -> dict:
         yield 'Tier', self.Tier
         yield 'Attributes', dict(self.Attributes)
         yield 'Skills', dict(self.Skills)
         yield 'Traits', dict(self.Traits)
+        if self.Purchases is not None:
+            yield 'Purchases', dict(self.Purchases)
         yield 'XPCost', dict(self.XPCost)
 
     def __str__(self):
         """
         Creates a markdown string-representation of the object.
         """
-        as_string = ""
-        for attr_name, _ in self:
-            as_string += f"\n## {attr_name}\n{getattr(self, attr_name)}\n"
-        return as_string
+        return CompactResults.from_results(self).to_markdown()
+
+
+def format_markdown_table(column_names: Sequence[str], rows: Sequence[Tuple[str, Sequence[Any]]]) -> str:
+    """
+    Creates a markdown table with a leading 'Name' column. All value columns share the same (left-aligned) width.
+    """
+    name_width = max([len('Name')] + [len(name) for name, _ in rows])
+    value_width = max([len(column_name) for column_name in column_names]
+                      + [len(str(value)) for _, values in rows for value in values])
+
+    name_format = "{0:" + str(name_width) + "}"
+    value_format = "{0:<" + str(value_width) + "}"
+    value_separator = ' | '
+
+    lines = [name_format.format('Name') + ''.join(value_separator + value_format.format(column_name)
+                                                  for column_name in column_names),
+             '-' * name_width + (value_separator + '-' * value_width) * len(column_names)]
+    lines.extend(name_format.format(name) + ''.join(value_separator + value_format.format(value) for value in values)
+                 for name, values in rows)
+    return '\n'.join(lines)
+
+
+class PropertyTable:
+    """
+    Compact, array-backed snapshot of a CharacterPropertyResults, holding one row per property with a total value.
+    """
+    __slots__ = ('row_names', 'ratings', 'totals', 'targets')
+
+    NO_TARGET: int = -2 ** 31  # Marks rows without target in `targets`
+
+    def __init__(self,
+                 row_names: Tuple[str, ...],
+                 totals: array,
+                 targets: array,
+                 ratings: Optional[array] = None):
+        self.row_names: Tuple[str, ...] = row_names
+        self.totals: array = totals
+        self.targets: array = targets
+        self.ratings: Optional[array] = ratings
+
+    @classmethod
+    def from_results(cls, results: CharacterPropertyResults) -> PropertyTable:
+        row_names = tuple(results.Total)
+        ratings = array('i', (results.Rating.get(name, 0) for name in row_names)) \
+            if isinstance(results, SkillResults) else None
+        return cls(row_names=row_names,
+                   totals=array('i', results.Total.values()),
+                   targets=array('i', (results.Target.get(name, cls.NO_TARGET) for name in row_names)),
+                   ratings=ratings)
+
+    @property
+    def column_names(self) -> Tuple[str, ...]:
+        return (('Rating',) if self.ratings is not None else ()) + ('Total', 'Target', 'Missed')
+
+    def iter_rows(self) -> Iterator[Tuple[str, Tuple[Optional[Union[int, bool]], ...]]]:
+        """
+        :return: Name & values (Rating, Total, Target, Missed) for each row; Target & Missed are None if not targeted.
+        """
+        for i, name in enumerate(self.row_names):
+            total = self.totals[i]
+            target = self.targets[i]
+            values = (total, None, None) if target == self.NO_TARGET else (total, target, total < target)
+            yield name, ((self.ratings[i],) + values if self.ratings is not None else values)
+
+    def to_markdown(self) -> str:
+        def to_cell(column_name: str, value: Optional[Union[int, bool]]):
+            if value is None:
+                return '-'
+            if column_name == 'Missed':
+                return 'YES' if value else 'NO'
+            return value
+
+        column_names = self.column_names
+        return format_markdown_table(column_names, [(name, tuple(map(to_cell, column_names, values)))
+                                                    for name, values in self.iter_rows()])
+
+    def to_dict(self) -> Dict[str, Union[Dict[str, int], List[str]]]:
+        """
+        :return: The same layout as `dict(CharacterPropertyResults)`.
+        """
+        as_dict = dict()
+        if self.ratings is not None:
+            as_dict['Rating'] = dict(zip(self.row_names, self.ratings))
+        as_dict['Total'] = dict(zip(self.row_names, self.totals))
+        as_dict['Target'] = {name: target for name, target in zip(self.row_names, self.targets)
+                             if target != self.NO_TARGET}
+        as_dict['Missed'] = [name for name, total, target in zip(self.row_names, self.totals, self.targets)
+                             if target != self.NO_TARGET and total < target]
+        return as_dict
+
+
+class CompactResults:
+    """
+    Compact snapshot of an AttributeSkillOptimizerResults, which renders to Markdown, CSV & JSON in a single pass.
+    """
+    __slots__ = ('tier', 'tables', 'xp_costs', 'purchases')
+
+    def __init__(self,
+                 tier: Optional[int],
+                 tables: Dict[str, PropertyTable],
+                 xp_costs: Tuple[int, int],
+                 purchases: Optional[Tuple[Tuple[str, int, int, int], ...]] = None):
+        self.tier: Optional[int] = tier
+        self.tables: Dict[str, PropertyTable] = tables  # Attributes, Skills & Traits
+        self.xp_costs: Tuple[int, int] = xp_costs  # Attributes & Skills
+        self.purchases: Optional[Tuple[Tuple[str, int, int, int], ...]] = purchases  # Name, current, new & XP cost
+
+    @classmethod
+    def from_results(cls, results: Union[AttributeSkillOptimizerResults, CompactResults]) -> CompactResults:
+        if isinstance(results, CompactResults):
+            return results
+        return cls(tier=results.Tier,
+                   tables={name: PropertyTable.from_results(getattr(results, name))
+                           for name in ('Attributes', 'Skills', 'Traits')},
+                   xp_costs=(results.XPCost.Attributes, results.XPCost.Skills),
+                   purchases=None if results.Purchases is None else tuple(
+                       (name, results.Purchases.Current[name], new_value, results.Purchases.XPCost[name])
+                       for name, new_value in results.Purchases.New.items()))
+
+    def iter_xp_costs(self) -> Iterator[Tuple[str, int]]:
+        yield 'Attributes', self.xp_costs[0]
+        yield 'Skills', self.xp_costs[1]
+        yield 'Total', sum(self.xp_costs)
+
+    def to_markdown(self) -> str:
+        """
+        :return: The same markdown as `str(AttributeSkillOptimizerResults)`.
+        """
+        sections = [('Tier', str(self.tier))]
+        sections.extend((name, table.to_markdown()) for name, table in self.tables.items())
+        if self.purchases is not None:
+            sections.append(('Purchases', format_markdown_table(('Current', 'New', 'XPCost'),
+                                                                [(name, values) for name, *values in self.purchases])))
+        sections.append(('XPCost', format_markdown_table(('Cost',), [(name, (cost,))
+                                                                     for name, cost in self.iter_xp_costs()])))
+        return ''.join(f"\n## {name}\n{content}\n" for name, content in sections)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        :return: The same layout as `dict(AttributeSkillOptimizerResults)`.
+        """
+        as_dict = {'Tier': self.tier, **{name: table.to_dict() for name, table in self.tables.items()}}
+        if self.purchases is not None:
+            as_dict['Purchases'] = {column_name: {purchase[0]: purchase[i] for purchase in self.purchases}
+                                    for i, column_name in enumerate(('Current', 'New', 'XPCost'), start=1)}
+        as_dict['XPCost'] = dict(self.iter_xp_costs())
+        return as_dict
+
+    def to_vector(self) -> List[int]:
+        """
+        :return: The compact positional layout for bulk clients: Tier, attribute totals, skill ratings, skill totals,
+                 trait totals (each in row order) & the attribute and skill XP costs. Targets & purchases are left out,
+                 since they follow from the request.
+        """
+        skills = self.tables['Skills']
+        return [self.tier, *self.tables['Attributes'].totals, *skills.ratings, *skills.totals,
+                *self.tables['Traits'].totals, *self.xp_costs]
+
+    def to_json(self, indent: Optional[int] = None) -> str:
+        """
+        :param indent: Indentation like in `json.dumps`; without, the JSON contains no optional whitespace.
+        """
+        return json.dumps(self.to_dict(), indent=indent, separators=None if indent is not None else (',', ':'))
+
+    def iter_csv_rows(self) -> Iterator[Tuple[Any, ...]]:
+        """
+        :return: Rows with the columns of `CsvResultWriter.HEADER` (without the result id). Purchases have the new
+                 rating as Rating & for them & the XP costs, Total is the XP cost.
+        """
+        for section, table in self.tables.items():
+            for name, values in table.iter_rows():
+                if table.ratings is None:
+                    values = (None,) + values
+                rating, total, target, missed = values
+                yield (self.tier, section, name, rating, total, target,
+                       None if missed is None else ('YES' if missed else 'NO'))
+        for name, _, new_rating, cost in self.purchases or ():
+            yield self.tier, 'Purchases', name, new_rating, cost, None, None
+        for name, cost in self.iter_xp_costs():
+            yield self.tier, 'XPCost', name, None, cost, None, None
+
+
+class ResultWriter(ABC):
+    """
+    Base class for streaming results into a text stream one-by-one, e.g. for bulk exports.
+    """
+
+    def __init__(self, stream: TextIO):
+        self.stream: TextIO = stream
+        self.result_count: int = 0
+
+    def write(self, result: Union[AttributeSkillOptimizerResults, CompactResults]):
+        self._write(CompactResults.from_results(result))
+        self.result_count += 1
+
+    def write_all(self, results: Iterable[Union[AttributeSkillOptimizerResults, CompactResults]]):
+        for result in results:
+            self.write(result)
+
+    @abstractmethod
+    def _write(self, result: CompactResults):
+        pass
+
+
+class MarkdownResultWriter(ResultWriter):
+    def _write(self, result: CompactResults):
+        if self.result_count:
+            self.stream.write('\n---\n')
+        self.stream.write(result.to_markdown())
+
+
+class JsonLinesResultWriter(ResultWriter):
+    """
+    Writes one compact JSON object per line (JSON Lines).
+    """
+
+    def _write(self, result: CompactResults):
+        self.stream.write(result.to_json())
+        self.stream.write('\n')
+
+
+class CsvResultWriter(ResultWriter):
+    """
+    Writes one row per property & XP cost; the result id is the index of the written result.
+    """
+    HEADER = ('Result', 'Tier', 'Section', 'Name', 'Rating', 'Total', 'Target', 'Missed')
+
+    def __init__(self, stream: TextIO):
+        super().__init__(stream)
+        self._csv_writer = csv.writer(stream, lineterminator='\n')
+        self._csv_writer.writerow(self.HEADER)
+
+    def _write(self, result: CompactResults):
+        self._csv_writer.writerows((self.result_count,) + row for row in result.iter_csv_rows())
+
+
+# Writer class by output format (e.g. for `--output_format` of the bulk export).
+RESULT_WRITERS = {'md': MarkdownResultWriter, 'json': JsonLinesResultWriter, 'csv': CsvResultWriter}
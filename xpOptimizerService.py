@@ -1,16 +1,28 @@
+import hashlib
+import itertools
 import json
 import logging.config
-import sys
+import math
+import os
+import signal
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Dict, Tuple, List, Iterator, Optional
 
-from flask import Flask, request, abort, Request
+from flask import Flask, request, abort, Request, make_response
 
 import xpOptimizer
+from xpOptimizerResults import CompactResults
 
 # Configure logging on WSGI server-defined stream with default config
 # from https://flask.palletsprojects.com/en/1.1.x/logging/#basic-configuration
 logging.config.dictConfig(
     {
         'version': 1,
+        'disable_existing_loggers': False,  # Keep the loggers of the optimizer (e.g. telemetry trace warnings)
         'formatters': {
             'default': {
                 'format': '[%(asctime)s] %(levelname)s in %(module)s: %(message)s',
@@ -33,6 +45,187 @@ app = Flask(__name__)
 
 MAX_ARGUMENT_COUNT_FOR_LOGGING = 10
 
+# Per-solve time limit & resource thresholds for recycling the worker (non-positive values disable the check).
+MAX_SOLVE_TIME = float(os.environ.get('XP_OPTIMIZER_MAX_SOLVE_TIME', 60))
+WORKER_RECYCLE_THRESHOLDS = xpOptimizer.SolveResourceUsage(
+    solve_count=int(os.environ.get('XP_OPTIMIZER_RECYCLE_MAX_SOLVES', 0)),
+    wall_time=float(os.environ.get('XP_OPTIMIZER_RECYCLE_MAX_WALL_TIME', 0)),
+    child_cpu_time=float(os.environ.get('XP_OPTIMIZER_RECYCLE_MAX_CHILD_CPU_TIME', 0)),
+    peak_rss_delta=int(os.environ.get('XP_OPTIMIZER_RECYCLE_MAX_RSS_GROWTH_KB', 0)),
+    temp_file_bytes=int(os.environ.get('XP_OPTIMIZER_RECYCLE_MAX_TEMP_FILE_BYTES', 0)))
+# Recycling terminates the worker process, so only enable it under a master, which respawns workers (e.g. gunicorn).
+IS_WORKER_RECYCLING_ENABLED = os.environ.get('XP_OPTIMIZER_RECYCLE_WORKERS', '').lower() in ('1', 'true', 'yes')
+
+# Optional JSON lines file for the solver telemetry of each request (e.g. to find pathological target values).
+TELEMETRY_TRACE_FILE = os.environ.get('XP_OPTIMIZER_TELEMETRY_TRACE_FILE') or None
+
+# Results only change with a new optimizer or rules version (which changes the ETag), so they can be cached for long.
+CACHE_CONTROL = f"public, max-age={int(os.environ.get('XP_OPTIMIZER_CACHE_MAX_AGE', 86400))}"
+
+
+# Compact positional layout for bulk clients (POST, see `optimize_xp_vectors`) & the max. number of rows per request.
+VECTOR_CONTENT_TYPE = 'application/vnd.xp-optimizer.vector+json'
+MAX_VECTOR_BATCH_SIZE = int(os.environ.get('XP_OPTIMIZER_MAX_VECTOR_BATCH_SIZE', 64))
+
+# Admission control (per worker process): Solves running in parallel & requests waiting for a free solver slot.
+MAX_CONCURRENT_SOLVES = int(os.environ.get('XP_OPTIMIZER_MAX_CONCURRENT_SOLVES', os.cpu_count() or 1))
+MAX_QUEUE_LENGTH = int(os.environ.get('XP_OPTIMIZER_MAX_QUEUE_LENGTH', 32))
+MAX_QUEUED_PER_CLIENT = int(os.environ.get('XP_OPTIMIZER_MAX_QUEUED_PER_CLIENT', 8))
+MAX_QUEUE_WAIT = float(os.environ.get('XP_OPTIMIZER_MAX_QUEUE_WAIT', 30))
+# Requests with at most this many targets (excluding the tier) or without MINLP solve are cheap & are preferred.
+MAX_CHEAP_TARGET_COUNT = int(os.environ.get('XP_OPTIMIZER_MAX_CHEAP_TARGET_COUNT', 3))
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after: int = retry_after
+
+
+@dataclass
+class AdmissionMetrics:
+    admitted: int = 0
+    rejected: int = 0
+    timed_out: int = 0
+    completed: int = 0
+    total_wait_time: float = 0.0
+    max_wait_time: float = 0.0
+    total_service_time: float = 0.0
+
+    @property
+    def mean_wait_time(self) -> float:
+        return self.total_wait_time / self.admitted if self.admitted else 0.0
+
+    @property
+    def mean_service_time(self) -> float:
+        return self.total_service_time / self.completed if self.completed else 0.0
+
+
+@dataclass
+class _AdmissionTicket:
+    client_id: str
+    cost_class: int
+    sequence: int
+    enqueue_time: float
+    is_admitted: bool = False
+
+
+class AdmissionController:
+    """
+    Bounded waiting queue in front of the solver. Free solver slots are handed out to the waiting request of the client
+    with the fewest running solves, then to cheaper requests, then in arrival order.
+    """
+
+    def __init__(self,
+                 max_concurrent_solves: int = MAX_CONCURRENT_SOLVES,
+                 max_queue_length: int = MAX_QUEUE_LENGTH,
+                 max_queued_per_client: int = MAX_QUEUED_PER_CLIENT,
+                 max_queue_wait: float = MAX_QUEUE_WAIT):
+        self.max_concurrent_solves: int = max(1, max_concurrent_solves)
+        self.max_queue_length: int = max_queue_length
+        self.max_queued_per_client: int = max_queued_per_client
+        self.max_queue_wait: float = max_queue_wait
+        self.metrics: AdmissionMetrics = AdmissionMetrics()
+        self._condition = threading.Condition()
+        self._waiting: List[_AdmissionTicket] = []
+        self._running_per_client: Dict[str, int] = defaultdict(int)
+        self._running_count: int = 0
+        self._sequence = itertools.count()
+
+    @contextmanager
+    def admit(self, client_id: str, cost_class: int) -> Iterator[float]:
+        """
+        Blocks until a solver slot is free for the request & releases it afterwards.
+
+        :param client_id: Identifies the client (e.g. API key or IP) for the fair sharing.
+        :param cost_class: Lower classes are admitted first (e.g. 0 = cheap, 1 = heavy).
+        :return: The time the request waited in the queue [s].
+        :raises AdmissionRejected: If the queue (or the client's share) is full or the wait took too long.
+        """
+        ticket, wait_time = self._acquire(client_id, cost_class)
+        start_time = time.perf_counter()
+        try:
+            yield wait_time
+        finally:
+            with self._condition:
+                self._running_count -= 1
+                self._running_per_client[ticket.client_id] -= 1
+                if not self._running_per_client[ticket.client_id]:
+                    del self._running_per_client[ticket.client_id]
+                self.metrics.completed += 1
+                self.metrics.total_service_time += time.perf_counter() - start_time
+                self._dispatch()
+
+    def get_state(self) -> Dict[str, int]:
+        with self._condition:
+            return {'queued': len(self._waiting), 'running': self._running_count}
+
+    def _acquire(self, client_id: str, cost_class: int) -> Tuple[_AdmissionTicket, float]:
+        with self._condition:
+            if len(self._waiting) >= self.max_queue_length:
+                self._reject("Queue is full.")
+            if sum(ticket.client_id == client_id for ticket in self._waiting) >= self.max_queued_per_client:
+                self._reject(f"Queue share of client '{client_id}' is used up.")
+
+            ticket = _AdmissionTicket(client_id=client_id,
+                                      cost_class=cost_class,
+                                      sequence=next(self._sequence),
+                                      enqueue_time=time.perf_counter())
+            self._waiting.append(ticket)
+            self._dispatch()
+            if not self._condition.wait_for(lambda: ticket.is_admitted, timeout=self.max_queue_wait):
+                self._waiting.remove(ticket)
+                self.metrics.timed_out += 1
+                self._reject(f"Request waited longer than {self.max_queue_wait}s.")
+
+            wait_time = time.perf_counter() - ticket.enqueue_time
+            self.metrics.admitted += 1
+            self.metrics.total_wait_time += wait_time
+            self.metrics.max_wait_time = max(self.metrics.max_wait_time, wait_time)
+            return ticket, wait_time
+
+    def _dispatch(self):
+        """
+        Hands out free solver slots to the waiting requests. Must be called with the lock held.
+        """
+        while self._waiting and self._running_count < self.max_concurrent_solves:
+            ticket = min(self._waiting,
+                         key=lambda t: (self._running_per_client[t.client_id], t.cost_class, t.sequence))
+            self._waiting.remove(ticket)
+            ticket.is_admitted = True
+            self._running_count += 1
+            self._running_per_client[ticket.client_id] += 1
+        self._condition.notify_all()
+
+    def _reject(self, reason: str):
+        """
+        Must be called with the lock held.
+        """
+        self.metrics.rejected += 1
+        # Estimate the time until the queue (incl. this request) is worked off.
+        expected_wait = self.metrics.mean_service_time * (len(self._waiting) + 1) / self.max_concurrent_solves
+        raise AdmissionRejected(reason, retry_after=max(1, math.ceil(expected_wait)))
+
+
+admission_controller = AdmissionController()
+
+
+def get_client_id(request: Request) -> str:
+    return request.headers.get('X-API-Key') or request.remote_addr or 'unknown'
+
+
+def get_cost_class(target_values: Dict[str, int], current_ratings: Optional[Dict[str, int]] = None) -> int:
+    """
+    :param target_values: Validated target values (incl. tier).
+    :param current_ratings: Validated current ratings (bounds of the solve), if any.
+    :return: 0 for cheap requests (closed-form solvable or few targets), 1 otherwise.
+    """
+    skill_attribute_targets = {name: value for name, value in target_values.items() if name != 'Tier'}
+    if len(skill_attribute_targets) <= MAX_CHEAP_TARGET_COUNT:
+        return 0
+    optimizer = xpOptimizer.AttributeSkillOptimizer(tier=target_values['Tier'])
+    return 0 if optimizer.presolve(skill_attribute_targets, current_ratings).is_closed_form_solvable else 1
+
 
 def request_to_str(request: Request, prefix: str = ">>> ", suffix: str = " <<<"):
     return f"\n{prefix}HEADER{suffix}\n" \
@@ -42,24 +235,180 @@ def request_to_str(request: Request, prefix: str = ">>> ", suffix: str = " <<<")
            f"args_keys: {tuple(request.args.keys()) if len(request.args) <= MAX_ARGUMENT_COUNT_FOR_LOGGING else '<TOO MANY>'}\n"
 
 
+def canonicalize_json_object(json_object: str) -> Tuple[Dict, str]:
+    """
+    :return: The decoded object (e.g. target values) with canonical property names & its canonical JSON representation
+             (sorted keys, no whitespace).
+    :raises ValueError: If the input is not a JSON object.
+    """
+    decoded_object = json.loads(json_object)
+    if not isinstance(decoded_object, dict):
+        raise ValueError(f"Expected a JSON object, got {type(decoded_object).__name__} instead.")
+    decoded_object = xpOptimizer.get_canonical_names(decoded_object)
+    return decoded_object, json.dumps(decoded_object, sort_keys=True, separators=(',', ':'))
+
+
+def get_etag(canonical_target_values: str, canonical_current_ratings: str = '') -> str:
+    """
+    Creates a strong ETag, which changes with the target values, the current ratings and the optimizer or rules
+    version.
+    """
+    versioned_input = f"{xpOptimizer.__version__}|" \
+                      f"{xpOptimizer.AttributeSkillOptimizer.WRATH_AND_GLORY_CORE_RULES_VERSION}|" \
+                      f"{canonical_target_values}|{canonical_current_ratings}"
+    return hashlib.sha256(versioned_input.encode('utf-8')).hexdigest()
+
+
+def optimize_compact_results(target_values: Dict[str, int],
+                             current_ratings: Optional[Dict[str, int]] = None) -> Optional[CompactResults]:
+    """
+    Runs the optimizer with the service's solve settings.
+
+    :return: The results or None, if the optimizer failed (the error is logged).
+    """
+    # noinspection PyBroadException
+    try:
+        return CompactResults.from_results(xpOptimizer.optimize_xp(
+            dict(target_values),
+            max_solve_time=MAX_SOLVE_TIME if MAX_SOLVE_TIME > 0 else None,
+            current_ratings=current_ratings,
+            telemetry_trace_file=TELEMETRY_TRACE_FILE))
+    except Exception:
+        app.logger.exception(f"Optimizer error for target values {target_values}, current ratings {current_ratings}.")
+        return None
+
+
+def make_rejection_response(rejection: AdmissionRejected):
+    app.logger.info(f"Request of client '{get_client_id(request)}' rejected: {rejection}")
+    response = make_response({'error': str(rejection)}, 429)
+    response.headers['Retry-After'] = str(rejection.retry_after)
+    return response
+
+
 @app.route('/optimize_xp')
 def optimize_xp():
     if "target_values" not in request.args:
         app.logger.info(f"Request without 'target_values' received. {request_to_str(request)}")
         abort(400)
 
-    if len(request.args) != 1:
+    if len(request.args) != 1 + ("current_ratings" in request.args):
         app.logger.warning(f"Unexpected number of arguments received. {request_to_str(request)}")
         # Ignore additional inputs
 
-    if not xpOptimizer.is_valid_target_values_dict(json.loads(request.args["target_values"])):
-        app.logger.info(f"Invalid target values dict received: '{request.args['target_values']}'")
+    current_ratings, canonical_current_ratings = None, ''
+    try:
+        target_values, canonical_target_values = canonicalize_json_object(request.args["target_values"])
+        if "current_ratings" in request.args:
+            current_ratings, canonical_current_ratings = canonicalize_json_object(request.args["current_ratings"])
+    except ValueError:
+        app.logger.info(f"Non-JSON-object target values or current ratings received: {request_to_str(request)}")
         abort(400)
 
-    # noinspection PyBroadException
+    etag = get_etag(canonical_target_values, canonical_current_ratings)
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        if not xpOptimizer.is_valid_target_values_dict(target_values):
+            app.logger.info(f"Invalid target values dict received: '{request.args['target_values']}'")
+            abort(400)
+        if current_ratings is not None and not xpOptimizer.is_valid_current_ratings_dict(current_ratings):
+            app.logger.info(f"Invalid current ratings dict received: '{request.args['current_ratings']}'")
+            abort(400)
+
+        try:
+            with admission_controller.admit(get_client_id(request), get_cost_class(target_values, current_ratings)):
+                compact_results = optimize_compact_results(target_values, current_ratings)
+        except AdmissionRejected as rejection:
+            return make_rejection_response(rejection)
+        if compact_results is None:
+            abort(500)
+        response = make_response(compact_results.to_dict())
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
+
+
+def parse_vector_row(row: List[int]) -> Tuple[Dict[str, int], Optional[Dict[str, int]]]:
+    """
+    :param row: A target vector, optionally followed by a current ratings vector.
+    :return: The target values (incl. tier) & the current ratings (None if not given).
+    :raises IOError: If the row has the wrong length.
+    :raises TypeError: If the row is no list.
+    """
+    if not isinstance(row, list):
+        raise TypeError(f"Expected a list, got {type(row).__name__} instead.")
+    target_count = len(xpOptimizer.TARGET_VECTOR_NAMES)
+    target_values = xpOptimizer.get_target_values_from_vector(row[:target_count])
+    current_ratings = xpOptimizer.get_current_ratings_from_vector(row[target_count:]) if len(row) > target_count \
+        else None
+    return target_values, current_ratings
+
+
+@app.route('/optimize_xp', methods=['POST'])
+def optimize_xp_vectors():
+    """
+    Bulk requests in the compact positional layout: The body is a JSON array of rows (see `parse_vector_row`), the
+    response is a JSON array with the result vector (see `CompactResults.to_vector`) or null (solver error) per row.
+    """
+    if request.mimetype != VECTOR_CONTENT_TYPE:
+        app.logger.info(f"Unsupported content type '{request.mimetype}' received, expected '{VECTOR_CONTENT_TYPE}'.")
+        abort(415)
+
     try:
-        return dict(xpOptimizer.optimize_xp(json.loads(request.args["target_values"])))
-    except:
-        app.logger.error(f"Optimizer error for target value dict {request.args['target_values']}: "
-                         f"{sys.exc_info()[0]}: {sys.exc_info()[1]}")
-        abort(500)
+        rows = json.loads(request.get_data())
+        if not isinstance(rows, list):
+            raise TypeError(f"Expected a list of rows, got {type(rows).__name__} instead.")
+        if len(rows) > MAX_VECTOR_BATCH_SIZE:
+            app.logger.info(f"Too many rows received: {len(rows)} > {MAX_VECTOR_BATCH_SIZE}")
+            abort(413)
+        parsed_rows = [parse_vector_row(row) for row in rows]
+    except (ValueError, IOError, TypeError) as error:
+        app.logger.info(f"Invalid target vectors received: {error}")
+        abort(400)
+
+    for target_values, current_ratings in parsed_rows:
+        if not xpOptimizer.is_valid_target_values_dict(target_values) \
+                or (current_ratings is not None and not xpOptimizer.is_valid_current_ratings_dict(current_ratings)):
+            app.logger.info(f"Invalid target vector received: {target_values}, current ratings: {current_ratings}")
+            abort(400)
+
+    result_vectors = []
+    try:
+        # Each row is admitted on its own (like a single request), so a batch holds at most one solver slot & the
+        # fair sharing between the clients applies between its rows.
+        for target_values, current_ratings in parsed_rows:
+            with admission_controller.admit(get_client_id(request), get_cost_class(target_values, current_ratings)):
+                compact_results = optimize_compact_results(target_values, current_ratings)
+            result_vectors.append(None if compact_results is None else compact_results.to_vector())
+    except AdmissionRejected as rejection:
+        return make_rejection_response(rejection)
+
+    response = make_response(json.dumps(result_vectors, separators=(',', ':')))
+    response.mimetype = VECTOR_CONTENT_TYPE
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    return {'admission': {**asdict(admission_controller.metrics),
+                          'mean_wait_time': admission_controller.metrics.mean_wait_time,
+                          'mean_service_time': admission_controller.metrics.mean_service_time,
+                          **admission_controller.get_state()},
+            'solver': asdict(xpOptimizer.GekkoContext.cumulative_usage)}
+
+
+@app.after_request
+def recycle_worker_on_exceeded_thresholds(response):
+    exceeded_counters = xpOptimizer.GekkoContext.cumulative_usage.exceeds(WORKER_RECYCLE_THRESHOLDS)
+    if exceeded_counters:
+        if not IS_WORKER_RECYCLING_ENABLED:
+            # E.g. the Flask dev server: Terminating would stop the whole service.
+            app.logger.warning(f"Thresholds exceeded for {exceeded_counters} in process {os.getpid()}, but worker "
+                               f"recycling is disabled: {xpOptimizer.GekkoContext.cumulative_usage}")
+            return response
+        app.logger.warning(f"Recycling worker {os.getpid()}, thresholds exceeded for {exceeded_counters}: "
+                           f"{xpOptimizer.GekkoContext.cumulative_usage}")
+        # Terminate after the response was sent; the WSGI server (e.g. gunicorn) spawns a fresh worker.
+        response.call_on_close(lambda: os.kill(os.getpid(), signal.SIGTERM))
+    return response